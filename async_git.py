@@ -0,0 +1,232 @@
+import os, signal, asyncio, threading, subprocess
+
+from collections import namedtuple
+from git.exc import GitCommandError
+
+CANCEL_CHECK_PERIOD=0.05 # seconds between checks whether a running command was cancelled
+DEFAULT_MAX_PROCESSES=4
+TERMINATE_GRACE=5 # seconds a stopped command gets to remove its lock files before it is killed
+CREATE_NO_WINDOW=getattr(subprocess, "CREATE_NO_WINDOW", 0) # Windows only, taskkill must not flash a console
+CREATE_NEW_PROCESS_GROUP=getattr(subprocess, "CREATE_NEW_PROCESS_GROUP", 0) # Windows only, lets CTRL_BREAK_EVENT reach the whole tree
+
+GitResult=namedtuple("GitResult", ["status", "stdout", "stderr"]) # exit status and decoded output of a git command
+
+class CommandCancelled(Exception):
+    """
+    Raised when a running git command was stopped because it was cancelled
+    """
+
+class AsyncGit():
+    """
+    Run git commands as asyncio subprocesses on a background event loop
+    
+    The event loop runs in its own daemon thread and threads waiting for
+    a command only wait for its result, so a hung git process can always
+    be given up on: a command is stopped after its timeout or as soon
+    as it is cancelled (e.g. the application is closing or a prefetch
+    was preempted by another setup). Stopped commands are first asked 
+    to exit (SIGTERM, CTRL_BREAK_EVENT on Windows) so git removes its 
+    lock files, and killed only if they are still running after 
+    TERMINATE_GRACE seconds. Commands changing the working tree must 
+    be run without timeout and cancellation. At most max_processes git
+    processes run at the same time, further commands wait for a free 
+    slot.
+    Synchronous callers (git manager threads) use run(), coroutines
+    running in the event loop await run_async().
+    
+    Methods
+    -------
+    run(args, cwd=None, timeout=None, cancelled=None, check=True)
+        Run a command and wait for it to finish
+    run_async(args, cwd=None, timeout=None, check=True)
+        Coroutine running a command in the event loop
+    """
+    def __init__(self, max_processes=DEFAULT_MAX_PROCESSES):
+        """
+        Parameters
+        ----------
+        max_processes : int, optional
+            number of git processes allowed to run at the same time
+        """
+        self._loop=asyncio.new_event_loop()
+        self._semaphore=None # created in the event loop thread, see _run_loop()
+        started=threading.Event()
+        self._thread=threading.Thread(target=self._run_loop, args=(max_processes, started), name="async-git", daemon=True)
+        self._thread.start()
+        started.wait()
+    
+    def _run_loop(self, max_processes, started):
+        asyncio.set_event_loop(self._loop)
+        self._semaphore=asyncio.Semaphore(max_processes)
+        started.set()
+        self._loop.run_forever()
+    
+    async def run_async(self, args, cwd=None, timeout=None, check=True):
+        """
+        Coroutine running a command in the event loop
+        
+        Parameters
+        ----------
+        args : list
+            command and its arguments, e.g. ["git", "fetch", "origin"]
+        cwd : str, optional
+            folder the command is run in
+        timeout : float, optional
+            seconds after which the command is stopped, no limit by
+            default
+        check : boolean, optional
+            raise GitCommandError if the command fails
+        
+        Returns
+        -------
+        GitResult
+            exit status, standard output without the trailing newline
+            and standard error of the command
+        
+        Raises
+        ------
+        GitCommandError
+            command failed and check is True
+        TimeoutError
+            command did not finish in time and was stopped
+        """
+        async with self._semaphore:
+            process=await asyncio.create_subprocess_exec(*args, cwd=cwd, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, 
+                                                         stderr=asyncio.subprocess.PIPE, start_new_session=True, 
+                                                         creationflags=CREATE_NEW_PROCESS_GROUP) # own process group, see signal_tree()
+            try:
+                stdout, stderr=await asyncio.wait_for(process.communicate(), timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError("stopped after {} s: {}".format(timeout, " ".join(args))) from None
+            finally:
+                if process.returncode is None: # timed out or cancelled, never leave git running
+                    await _stop_tree(process)
+        result=GitResult(process.returncode, _decode(stdout), _decode(stderr))
+        if check and (result.status != 0):
+            raise GitCommandError(args, result.status, result.stderr, result.stdout)
+        return result
+    
+    async def _run_cancellable(self, args, cwd, timeout, cancelled, check):
+        # run the command, killing it as soon as cancelled() returns True
+        task=self._loop.create_task(self.run_async(args, cwd, timeout, check))
+        while not task.done():
+            await asyncio.wait([task], timeout=CANCEL_CHECK_PERIOD)
+            if (not task.done()) and cancelled():
+                task.cancel()
+                try:
+                    await task # process is stopped when the task is cancelled
+                except asyncio.CancelledError:
+                    pass
+                raise CommandCancelled(" ".join(args))
+        return task.result()
+    
+    def run(self, args, cwd=None, timeout=None, cancelled=None, check=True):
+        """
+        Run a command and wait for it to finish
+        
+        Thread safe, must not be called from the event loop thread.
+        
+        Parameters
+        ----------
+        args : list
+            command and its arguments, e.g. ["git", "fetch", "origin"]
+        cwd : str, optional
+            folder the command is run in
+        timeout : float, optional
+            seconds after which the command is stopped, no limit by
+            default
+        cancelled : function, optional
+            called periodically (from the event loop thread) while the
+            command runs, the command is stopped when it returns True
+        check : boolean, optional
+            raise GitCommandError if the command fails
+        
+        Returns
+        -------
+        GitResult
+            exit status, standard output without the trailing newline
+            and standard error of the command
+        
+        Raises
+        ------
+        GitCommandError
+            command failed and check is True
+        TimeoutError
+            command did not finish in time and was stopped
+        CommandCancelled
+            command was stopped because cancelled() returned True
+        """
+        if cancelled is None:
+            coroutine=self.run_async(args, cwd, timeout, check)
+        else:
+            coroutine=self._run_cancellable(args, cwd, timeout, cancelled, check)
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+async def _stop_tree(process):
+    # ask git to exit so it removes its lock files, kill it if it does not exit in time
+    signal_tree(process, force=False)
+    try:
+        await asyncio.wait_for(process.wait(), TERMINATE_GRACE)
+    except asyncio.TimeoutError:
+        signal_tree(process, force=True)
+        await process.wait()
+
+def signal_tree(process, force):
+    """
+    Signal a process together with the processes it started
+    
+    Children (remote helpers, ssh, hooks, commands started by a shell)
+    hold the output pipes open until they exit, so the whole tree is
+    signalled. The process must have been started in its own session 
+    (start_new_session) or process group (CREATE_NEW_PROCESS_GROUP).
+    
+    Parameters
+    ----------
+    process : subprocess.Popen or asyncio.subprocess.Process
+        the process started in its own process group
+    force : boolean
+        kill the processes, otherwise ask them to exit (SIGTERM, 
+        CTRL_BREAK_EVENT on Windows)
+    """
+    try:
+        if os.name == "nt":
+            if force:
+                subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, 
+                               creationflags=CREATE_NO_WINDOW)
+            else:
+                process.send_signal(signal.CTRL_BREAK_EVENT)
+        else:
+            os.killpg(process.pid, signal.SIGKILL if force else signal.SIGTERM)
+    except ProcessLookupError: # exited in the meantime
+        pass
+
+def _decode(output):
+    # decode output of git, trailing newline is removed the same way as GitPython does
+    text=output.decode("utf-8", errors="replace")
+    return text[:-1] if text.endswith("\n") else text
+
+_shared_runner=None
+_shared_runner_lock=threading.Lock()
+
+def shared_runner(max_processes=DEFAULT_MAX_PROCESSES):
+    """
+    Return the runner shared by all git managers of the process
+    
+    The runner is created by the first call, so max_processes of the
+    first call applies to the whole process.
+    
+    Parameters
+    ----------
+    max_processes : int, optional
+        number of git processes allowed to run at the same time
+    
+    Returns
+    -------
+    AsyncGit
+        runner with its event loop thread started
+    """
+    global _shared_runner
+    with _shared_runner_lock:
+        if _shared_runner is None:
+            _shared_runner=AsyncGit(max_processes)
+        return _shared_runner
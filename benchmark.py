@@ -0,0 +1,326 @@
+import os, sys, json, time, queue, argparse, tempfile, threading, subprocess, shutil, tracemalloc
+
+import mcp_gui
+
+BRANCH_PREFIXES=("AIR1281", "AIR5322", "Dualband8843", "SM6705") # setups are spread over these product prefixes
+GIT_ENV=dict(os.environ, GIT_AUTHOR_NAME="Benchmark", GIT_AUTHOR_EMAIL="benchmark@localhost",
+             GIT_COMMITTER_NAME="Benchmark", GIT_COMMITTER_EMAIL="benchmark@localhost")
+
+def git(*args, cwd=None, stdin=None):
+    """
+    Run git command and return its output
+    
+    Parameters
+    ----------
+    *args : str
+        git arguments
+    cwd : str, optional
+        working directory of the command
+    stdin : bytes, optional
+        data written to standard input of the command
+    
+    Returns
+    -------
+    str
+        standard output of the command
+    """
+    result=subprocess.run(["git", *args], cwd=cwd, input=stdin, env=GIT_ENV, stdout=subprocess.PIPE, check=True)
+    return result.stdout.decode()
+
+def branch_name(index):
+    # synthetic setup name, e.g. AIR5322_setup_00001
+    return "{}_setup_{:05d}".format(BRANCH_PREFIXES[index % len(BRANCH_PREFIXES)], index)
+
+def create_origin(path, branches, commits, files):
+    """
+    Create bare "origin" repository with synthetic test setups
+    
+    History is generated with git fast-import: one base commit on main
+    with the given number of files and for every branch the given
+    number of commits on top of it, each changing one file.
+    
+    Parameters
+    ----------
+    path : str
+        path of the bare repository to create
+    branches : int
+        number of setup branches
+    commits : int
+        number of commits on every branch
+    files : int
+        number of files in the base commit
+    """
+    git("init", "--quiet", "--bare", path)
+    stream=[]
+    def data(text):
+        encoded=text.encode()
+        stream.append(b"data %d\n%s\n" % (len(encoded), encoded))
+    
+    stream.append(b"commit refs/heads/main\nmark :1\ncommitter Benchmark <benchmark@localhost> 0 +0000\n")
+    data("base")
+    for index in range(files):
+        stream.append(b"M 100644 inline config/file_%05d.txt\n" % index)
+        data("setting {}\n".format(index)*20)
+    for index in range(branches):
+        stream.append("commit refs/heads/{}\n".format(branch_name(index)).encode())
+        stream.append(b"committer Benchmark <benchmark@localhost> 0 +0000\n")
+        data("setup {}".format(index))
+        stream.append(b"from :1\n")
+        for commit in range(commits):
+            if commit:
+                stream.append("commit refs/heads/{}\n".format(branch_name(index)).encode())
+                stream.append(b"committer Benchmark <benchmark@localhost> 0 +0000\n")
+                data("setup {} change {}".format(index, commit))
+            stream.append(b"M 100644 inline config/file_%05d.txt\n" % ((index+commit) % max(files, 1)))
+            data("setup {} change {}\n".format(index, commit))
+    git("fast-import", "--quiet", cwd=path, stdin=b"".join(stream))
+    git("symbolic-ref", "HEAD", "refs/heads/main", cwd=path) # clones check out main
+
+def push_commit(origin, branch, message):
+    """
+    Add a commit directly to a branch of the origin repository
+    
+    Parameters
+    ----------
+    origin : str
+        path of the bare repository
+    branch : str
+        existing branch to move
+    message : str
+        commit message
+    
+    Returns
+    -------
+    str
+        SHA of the new commit
+    """
+    parent="refs/heads/"+branch
+    tree=git("rev-parse", parent+"^{tree}", cwd=origin).strip()
+    sha=git("commit-tree", tree, "-p", parent, "-m", message, cwd=origin).strip() # on top of the branch, so the active setup fast-forwards
+    git("update-ref", "refs/heads/"+branch, sha, cwd=origin)
+    return sha
+
+class ManagerProbe():
+    """
+    Drive GitManager headlessly and observe its callbacks
+    
+    Methods
+    -------
+    wait_poll(timeout)
+        Request a poll and return its duration
+    wait_setup_event(setup_name, timeout)
+        Wait until the manager reports a change of the setup
+    load(setup_name, timeout)
+        Load setup and return time until the callback was called
+    """
+    def __init__(self, settings):
+        """
+        Parameters
+        ----------
+        settings : mcp_gui.SettingsHandler
+            settings pointing to the benchmarked repository
+        """
+        self._events=queue.Queue()
+        self.errors=[]
+        self.manager=mcp_gui.GitManager(threading.Event(), settings)
+        self.manager.start_updating(lambda events: self._events.put(events), self.errors.append)
+    
+    def _last_poll(self):
+        return self.manager.metrics.last("poll")
+    
+    def wait_poll(self, timeout=600):
+        """
+        Request a poll and return its duration
+        
+        Parameters
+        ----------
+        timeout : float, optional
+            maximum seconds to wait
+        
+        Returns
+        -------
+        float
+            duration of the poll in seconds as measured by the manager
+        """
+        previous=self._last_poll()
+        self.manager.refresh_now()
+        deadline=time.monotonic()+timeout
+        while self._last_poll() is previous:
+            if self.errors:
+                raise RuntimeError(self.errors[-1])
+            if time.monotonic() > deadline:
+                raise TimeoutError("poll did not finish")
+            time.sleep(0.001)
+        return self._last_poll()[0]
+    
+    def wait_setup_event(self, setup_name, timeout=600):
+        """
+        Wait until the manager reports a change of the setup
+        
+        Parameters
+        ----------
+        setup_name : str
+            name of the setup
+        timeout : float, optional
+            maximum seconds to wait
+        """
+        deadline=time.monotonic()+timeout
+        while True:
+            events=self._events.get(timeout=max(deadline-time.monotonic(), 0))
+            if any(event.name == setup_name for event in events):
+                return
+    
+    def load(self, setup_name, timeout=600):
+        """
+        Load setup and return time until the callback was called
+        
+        Parameters
+        ----------
+        setup_name : str
+            name of the setup
+        timeout : float, optional
+            maximum seconds to wait
+        
+        Returns
+        -------
+        float
+            seconds from the request until the setup was loaded
+        """
+        loaded=threading.Event()
+        start=time.perf_counter()
+        self.manager.load_setup(setup_name, lambda name: loaded.set())
+        if not loaded.wait(timeout):
+            raise TimeoutError("setup {} was not loaded".format(setup_name))
+        return time.perf_counter()-start
+    
+    def stop(self):
+        self.manager.stop()
+        self.manager.join()
+
+def summary(values):
+    # minimum, median and maximum of measured values in milliseconds
+    values=sorted(values)
+    return {"min_ms": round(values[0]*1000, 2), "median_ms": round(values[len(values)//2]*1000, 2), "max_ms": round(values[-1]*1000, 2), "samples": len(values)}
+
+def run_case(work_dir, branches, commits, files, repeats):
+    """
+    Benchmark GitManager against a synthetic origin with given size
+    
+    Parameters
+    ----------
+    work_dir : str
+        empty folder for the repositories of this case
+    branches : int
+        number of setup branches in origin
+    commits : int
+        number of commits on every branch
+    files : int
+        number of files in the base commit
+    repeats : int
+        number of measurements of each operation
+    
+    Returns
+    -------
+    dict
+        measured latencies and memory usage
+    """
+    import async_git, git as gitpython # loaded by the manager on start, import them first so they are not counted in memory usage of the case
+    origin=os.path.join(work_dir, "origin.git")
+    clone=os.path.join(work_dir, "clone")
+    start=time.perf_counter()
+    create_origin(origin, branches, commits, files)
+    git("clone", "--quiet", origin, clone)
+    setup_time=time.perf_counter()-start
+    settings_file=os.path.join(work_dir, "settings.ini")
+    with open(settings_file, 'w') as f:
+        f.write("[main]\nrepo_path = {0}\nwsl_app_path = {1} ~\nsftp_path = explorer.exe /e,{1}\ntimeout = 3600\n".format(clone, work_dir))
+    
+    if sys.platform != "win32":
+        import resource
+        baseline_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    start=time.perf_counter()
+    probe=ManagerProbe(mcp_gui.SettingsHandler(settings_file))
+    try:
+        probe.wait_setup_event(branch_name(0))
+        first_poll=time.perf_counter()-start
+        heap_bytes=tracemalloc.get_traced_memory()[0]
+        idle_polls=[probe.wait_poll() for _ in range(repeats)]
+        detection=[]
+        for index in range(repeats):
+            changed_branch=branch_name(index % branches)
+            push_commit(origin, changed_branch, "benchmark change {}".format(index))
+            start=time.perf_counter()
+            probe.manager.refresh_now()
+            probe.wait_setup_event(changed_branch)
+            detection.append(time.perf_counter()-start)
+        switches=[probe.load(branch_name((index+1) % branches)) for index in range(repeats)]
+    finally:
+        probe.stop()
+        tracemalloc.stop()
+    result={"branches": branches, "commits_per_branch": commits, "files": files,
+            "origin_setup_s": round(setup_time, 2), "first_poll_ms": round(first_poll*1000, 2),
+            "idle_poll": summary(idle_polls), "change_detection": summary(detection), "switch": summary(switches),
+            "python_heap_bytes": heap_bytes}
+    if sys.platform != "win32":
+        result["max_rss_kb"]=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result["rss_growth_kb"]=result["max_rss_kb"]-baseline_rss
+    return result
+
+def run_case_process(branches, commits, files, repeats):
+    """
+    Run one case in a new Python process
+    
+    Every case starts from the same fresh process, so its peak memory
+    usage is not inflated by the cases run before it.
+    
+    Parameters
+    ----------
+    branches : int
+        number of setup branches in origin
+    commits : int
+        number of commits on every branch
+    files : int
+        number of files in the base commit
+    repeats : int
+        number of measurements of each operation
+    
+    Returns
+    -------
+    dict
+        result of run_case
+    """
+    command=[sys.executable, os.path.abspath(__file__), "--single-case", "--branches", str(branches), "--commits", str(commits), 
+             "--files", str(files), "--repeats", str(repeats)]
+    result=subprocess.run(command, stdout=subprocess.PIPE, check=True)
+    return json.loads(result.stdout.decode())
+
+if __name__ == "__main__":
+    parser=argparse.ArgumentParser(description="Benchmark MCP manager against a synthetic local origin repository")
+    parser.add_argument("--branches", type=int, nargs="+", default=[10, 100, 1000, 10000], help="branch counts to benchmark")
+    parser.add_argument("--commits", type=int, default=2, help="commits on every branch")
+    parser.add_argument("--files", type=int, default=100, help="files in the repository")
+    parser.add_argument("--repeats", type=int, default=5, help="measurements of each operation")
+    parser.add_argument("--output", help="write JSON results to this file instead of standard output")
+    parser.add_argument("--single-case", action="store_true", help=argparse.SUPPRESS) # run_case_process(): run the first branch count here and print its result
+    args=parser.parse_args()
+    os.environ.update(GIT_ENV) # git commands of the manager need an identity too
+    
+    if args.single_case:
+        work_dir=tempfile.mkdtemp(prefix="mcp_benchmark_")
+        try:
+            print(json.dumps(run_case(work_dir, args.branches[0], args.commits, args.files, args.repeats)))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        sys.exit(0)
+    
+    results=[]
+    for branches in args.branches:
+        results.append(run_case_process(branches, args.commits, args.files, args.repeats))
+        print("{} branches done".format(branches), file=sys.stderr)
+    report=json.dumps({"time": time.time(), "python": sys.version.split()[0], "git": git("--version").strip(), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report+"\n")
+    else:
+        print(report)
@@ -0,0 +1,169 @@
+import os, sys, time, json, fnmatch, threading, subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+from async_git import signal_tree, CREATE_NEW_PROCESS_GROUP
+
+def select_setups(setups, patterns):
+    """
+    Return setups matching any of the patterns
+    
+    Parameters
+    ----------
+    setups : iterable
+        names of all setups (branches)
+    patterns : list
+        setup names or shell-style patterns, e.g. AIR1281_*
+    
+    Returns
+    -------
+    list
+        sorted names of matching setups
+    """
+    return sorted(name for name in setups if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns))
+
+class CampaignRunner():
+    """
+    Run a command for many setups in parallel
+    
+    Every setup is checked out in its own worktree (detached HEAD at
+    the latest fetched commit of its branch) in the campaign folder and
+    the command is run there, at most jobs commands at a time. Worktrees
+    are kept after the campaign, so the next campaign only checks out
+    what has changed. The command gets the setup name and worktree path
+    in environment variables MCP_SETUP and MCP_WORKTREE, its output is
+    written to a log file per setup.
+    
+    Methods
+    -------
+    run(setups, command)
+        Run the command for every setup and return the summary
+    """
+    def __init__(self, repo, campaign_path, jobs=None, timeout=None):
+        """
+        Parameters
+        ----------
+        repo : git.Repo
+            repository the worktrees are added to
+        campaign_path : str
+            folder for the worktrees and logs
+        jobs : int, optional
+            number of commands run at the same time, number of CPUs by
+            default
+        timeout : float, optional
+            seconds after which a command is killed, no limit by default
+        """
+        self._repo=repo
+        self._campaign_path=campaign_path
+        self._jobs=jobs or os.cpu_count() or 1
+        self._timeout=timeout
+        self._worktree_lock=threading.Lock() # "git worktree add" changes files shared by all worktrees
+        self._log_path=os.path.join(campaign_path, ".logs") # branch names can not start with a dot, no worktree uses this folder
+    
+    def _worktree_path(self, setup_name):
+        # branch names may contain slashes, worktrees are kept flat in the campaign folder
+        return os.path.join(self._campaign_path, setup_name.replace("/", "+"))
+    
+    def _materialize(self, setup_name):
+        # check out the setup in its worktree, returns the checked out SHA
+        path=self._worktree_path(setup_name)
+        with self._worktree_lock:
+            if not os.path.exists(os.path.join(path, ".git")):
+                self._repo.git.worktree("add", "--no-checkout", "--detach", path, "origin/"+setup_name)
+        self._repo.git.execute(["git", "-C", path, "checkout", "--force", "--detach", "origin/"+setup_name]) # worktrees have their own index, run in parallel
+        return self._repo.git.execute(["git", "-C", path, "rev-parse", "HEAD"])
+    
+    def _run_setup(self, setup_name, command):
+        # materialize the setup and run the command, returns the result dictionary
+        result={"setup": setup_name, "sha": None, "exit_code": None, "checkout_seconds": None, "run_seconds": None,
+                "log": os.path.join(self._log_path, setup_name.replace("/", "+")+".log")}
+        start=time.perf_counter()
+        with open(result["log"], 'w') as log:
+            try:
+                result["sha"]=self._materialize(setup_name)
+            except Exception as err: # report failed checkout as failed setup, the campaign goes on
+                log.write("checkout failed: {}\n".format(err))
+                result["error"]="checkout failed"
+                return result
+            result["checkout_seconds"]=round(time.perf_counter()-start, 3)
+            env=dict(os.environ, MCP_SETUP=setup_name, MCP_WORKTREE=self._worktree_path(setup_name))
+            start=time.perf_counter()
+            process=subprocess.Popen(command, shell=True, cwd=self._worktree_path(setup_name), env=env, stdout=log, stderr=subprocess.STDOUT,
+                                     start_new_session=True, creationflags=CREATE_NEW_PROCESS_GROUP) # own process group, the shell is not the only process to kill
+            try:
+                result["exit_code"]=process.wait(self._timeout)
+            except subprocess.TimeoutExpired:
+                signal_tree(process, force=True) # commands started by the shell must not keep writing the log
+                process.wait()
+                log.write("\nkilled after {} s\n".format(self._timeout))
+                result["error"]="timeout"
+            result["run_seconds"]=round(time.perf_counter()-start, 3)
+        return result
+    
+    def run(self, setups, command):
+        """
+        Run the command for every setup and return the summary
+        
+        Parameters
+        ----------
+        setups : list
+            names of the setups
+        command : str
+            shell command run in the worktree of every setup
+        
+        Returns
+        -------
+        dict
+            summary with the command, number of jobs, wall clock time,
+            numbers of passed and failed setups and a list of results
+            (setup, sha, exit_code, checkout_seconds, run_seconds, log)
+        """
+        os.makedirs(self._log_path, exist_ok=True)
+        started=time.time()
+        start=time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self._jobs) as executor: # threads only wait for the processes
+            results=list(executor.map(lambda setup_name: self._run_setup(setup_name, command), setups))
+        passed=sum(1 for result in results if result["exit_code"] == 0)
+        return {"command": command, "jobs": self._jobs, "started": started, "wall_seconds": round(time.perf_counter()-start, 3),
+                "passed": passed, "failed": len(results)-passed, "results": results}
+
+def run_campaign(settings, patterns, command, jobs=None, timeout=None, output=None):
+    """
+    Fetch the setups matching the patterns and run the command for each
+    
+    Parameters
+    ----------
+    settings : SettingsHandler
+        settings of the application (repository and campaign folder)
+    patterns : list
+        setup names or shell-style patterns
+    command : str
+        shell command run in the worktree of every setup
+    jobs : int, optional
+        number of commands run at the same time
+    timeout : float, optional
+        seconds after which a command is killed
+    output : str, optional
+        file the JSON summary is written to, printed if not given
+    
+    Returns
+    -------
+    int
+        0 if the command succeeded for every setup, 1 otherwise
+    """
+    import git
+    repo=git.Repo(settings.repo_path)
+    source=settings.mirror_path or "origin" # the shared mirror replaces the server in mirror mode
+    repo.git.fetch("--prune", source, "+refs/heads/*:refs/remotes/origin/*")
+    branches=repo.git.for_each_ref("--format=%(refname:lstrip=3)", "refs/remotes/origin").splitlines()
+    setups=select_setups([name for name in branches if name != "HEAD"], patterns)
+    if not setups:
+        print("No setup matches "+" ".join(patterns), file=sys.stderr)
+        return 1
+    summary=CampaignRunner(repo, settings.campaign_path, jobs, timeout).run(setups, command)
+    report=json.dumps(summary, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(report+"\n")
+    else:
+        print(report)
+    return 0 if summary["failed"] == 0 else 1
@@ -0,0 +1,290 @@
+import sys, json, threading
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+LOAD_TIMEOUT=300 # default seconds to wait for a setup to load when client asks to wait
+
+class SetupState():
+    """
+    Thread safe copy of setups reported by git manager
+    
+    Provides the same callback methods as GitGui so it can be passed
+    to git_manager instead of the GUI. Every client request is served
+    from this copy, no git command is run to answer a query. Setups
+    list is serialized to JSON once per change and shared by all
+    requests.
+    
+    Methods
+    -------
+    update_setups_list(events)
+        Callback for git_manager when test setups change
+    error_print(err_str)
+        Callback for git_manager when exception is raised
+    setup_loaded(setup_name)
+        Callback for git_manager when active setup changes
+    setup_status(setup_name, status)
+        Callback for git_manager when state of the active setup changes
+    setups_json()
+        Return JSON encoded setups
+    status()
+        Return active setup, its state, setup being loaded and last error
+    load(setup_name, wait=False, timeout=LOAD_TIMEOUT)
+        Queue loading of a setup and optionally wait for it
+    refresh()
+        Poll the git server now
+    """
+    def __init__(self, git_man):
+        """
+        Parameters
+        ----------
+        git_man : GitManager
+            git manager whose setups are served
+        """
+        self._git_man=git_man
+        self._condition=threading.Condition()
+        cache=git_man.get_cached_setups()
+        self._setups=dict(cache["setups"]) if cache is not None else {}
+        self._active=cache["active"] if cache is not None else None
+        self._loading=None
+        self._state="ok" # STATUS_* value reported by git manager for the active setup
+        self._errors=0 # number of exceptions reported, lets waiting clients notice a failure
+        self._last_error=None
+        self._setups_json=None # serialized setups, None when it has to be rebuilt
+    
+    def update_setups_list(self, events):
+        """
+        Callback for git_manager when test setups change
+        
+        Parameters
+        ----------
+        events : list
+            list of SetupEvent tuples describing the changes
+        """
+        with self._condition:
+            for event in events:
+                if event.kind == "removed":
+                    self._setups.pop(event.name, None)
+                else:
+                    self._setups[event.name]=event.sha
+            self._setups_json=None
+    
+    def error_print(self, err_str):
+        """
+        Callback for git_manager when exception is raised
+        
+        Unlike the GUI the daemon keeps running, the error is printed
+        and reported to clients.
+        
+        Parameters
+        ----------
+        err_str : str
+            string containing traceback of the exception
+        """
+        print(err_str, file=sys.stderr)
+        with self._condition:
+            self._last_error=err_str
+            self._errors+=1
+            self._loading=None
+            self._condition.notify_all()
+    
+    def setup_loaded(self, setup_name):
+        """
+        Callback for git_manager when active setup changes
+        
+        Parameters
+        ----------
+        setup_name : str
+            name of the active setup
+        """
+        with self._condition:
+            self._active=setup_name
+            if self._loading == setup_name:
+                self._loading=None
+            self._condition.notify_all()
+    
+    def setup_status(self, setup_name, status):
+        """
+        Callback for git_manager when state of the active setup changes
+        
+        Parameters
+        ----------
+        setup_name : str
+            name of the active setup
+        status : str
+            "ok", "dirty", "diverged", "deleted", "offline", "timeout" or
+            "blocked"
+        """
+        with self._condition:
+            self._state=status
+    
+    def setups_json(self):
+        """
+        Return JSON encoded setups
+        
+        Returns
+        -------
+        bytes
+            JSON object with branch names as keys and SHAs as values
+        """
+        with self._condition:
+            if self._setups_json is None:
+                self._setups_json=json.dumps({"setups": self._setups}, separators=(",", ":")).encode()
+            return self._setups_json
+    
+    def status(self):
+        """
+        Return active setup, its state, setup being loaded and last error
+        
+        Returns
+        -------
+        dict
+            dictionary with keys "active", "state", "loading" and "error"
+        """
+        with self._condition:
+            return {"active": self._active, "state": self._state, "loading": self._loading, "error": self._last_error}
+    
+    def load(self, setup_name, wait=False, timeout=LOAD_TIMEOUT):
+        """
+        Queue loading of a setup and optionally wait for it
+        
+        Parameters
+        ----------
+        setup_name : str
+            the name of the setup to load
+        wait : boolean, optional
+            wait until the setup is loaded or loading fails
+        timeout : float, optional
+            maximum seconds to wait
+        
+        Returns
+        -------
+        str
+            "queued" if not waiting, otherwise "loaded", "failed" or
+            "timeout"
+        
+        Raises
+        ------
+        KeyError
+            if there is no such setup
+        """
+        done=threading.Event()
+        def loaded(name):
+            self.setup_loaded(name)
+            with self._condition:
+                done.set()
+                self._condition.notify_all()
+        
+        with self._condition:
+            if setup_name not in self._setups:
+                raise KeyError(setup_name)
+            errors=self._errors
+            self._loading=setup_name
+        self._git_man.load_setup(setup_name, loaded)
+        if not wait:
+            return "queued"
+        with self._condition:
+            self._condition.wait_for(lambda: done.is_set() or (self._errors != errors), timeout)
+            if done.is_set():
+                return "loaded"
+            return "failed" if self._errors != errors else "timeout"
+    
+    def refresh(self):
+        """
+        Poll the git server now
+        """
+        self._git_man.refresh_now()
+
+
+class ApiRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handle requests of the local JSON API
+    
+    Endpoints
+    ---------
+    GET /setups
+        {"setups": {name: sha}}
+    GET /active
+        {"active": name, "state": "ok"|"dirty"|"diverged"|"deleted"|"offline"|"timeout"|"blocked",
+         "loading": name or null, "error": str or null}
+    POST /load
+        body {"setup": name, "wait": bool, "timeout": seconds}, replies
+        {"setup": name, "result": "queued"|"loaded"|"failed"|"timeout"},
+        400 {"error": reason} if the body is not an object of these types
+    POST /refresh
+        poll the git server now
+    """
+    def do_GET(self):
+        if self.path == "/setups":
+            self._reply(200, self.server.state.setups_json())
+        elif self.path == "/active":
+            self._reply_json(200, self.server.state.status())
+        else:
+            self._reply_json(404, {"error": "unknown endpoint"})
+    
+    def do_POST(self):
+        try:
+            length=int(self.headers.get("Content-Length", 0))
+            body=json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._reply_json(400, {"error": "request body must be JSON"})
+            return
+        if not isinstance(body, dict):
+            self._reply_json(400, {"error": "request body must be a JSON object"})
+            return
+        if self.path == "/load":
+            setup_name=body.get("setup")
+            wait=body.get("wait", False)
+            timeout=body.get("timeout", LOAD_TIMEOUT)
+            if not isinstance(setup_name, str):
+                self._reply_json(400, {"error": "setup must be a string"})
+                return
+            if not isinstance(wait, bool):
+                self._reply_json(400, {"error": "wait must be true or false"})
+                return
+            if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or not (0 <= timeout < float("inf")): # bool is an int too
+                self._reply_json(400, {"error": "timeout must be a number of seconds"})
+                return
+            try:
+                result=self.server.state.load(setup_name, wait, timeout)
+            except KeyError:
+                self._reply_json(404, {"error": "unknown setup", "setup": setup_name})
+                return
+            status={"queued": 202, "loaded": 200, "failed": 500, "timeout": 504}[result]
+            self._reply_json(status, {"setup": setup_name, "result": result})
+        elif self.path == "/refresh":
+            self.server.state.refresh()
+            self._reply_json(202, {"result": "queued"})
+        else:
+            self._reply_json(404, {"error": "unknown endpoint"})
+    
+    def _reply_json(self, status, data):
+        self._reply(status, json.dumps(data).encode())
+    
+    def _reply(self, status, payload):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def log_message(self, format, *args):
+        pass # do not print a line for every request
+
+
+class ApiServer(ThreadingHTTPServer):
+    """
+    Local HTTP server of the JSON API, each request in its own thread
+    """
+    daemon_threads=True
+    
+    def __init__(self, port, state):
+        """
+        Parameters
+        ----------
+        port : int
+            local port to listen on (only 127.0.0.1 is bound)
+        state : SetupState
+            setups served to the clients
+        """
+        ThreadingHTTPServer.__init__(self, ("127.0.0.1", port), ApiRequestHandler)
+        self.state=state
@@ -1,12 +1,131 @@
+import time
+STARTUP_T0=time.perf_counter() # reference point for start up timing marks, see mark_startup()
+
 import tkinter as tk
 import tkinter.ttk as ttk
-import sys, os, traceback, git, re, threading, subprocess
+import sys, os, traceback, threading, subprocess, socket, random, zlib, queue, itertools, json, argparse, contextlib, functools, urllib.parse
+
+from collections import namedtuple, OrderedDict
 
-from ignore_setups import ignore_setups
+from setup_filter import SetupFilter
+from sparse_profiles import SparseProfiles
+from setup_picker import SetupPicker
+from mirror import SharedMirror
+from metrics import Metrics
 from tkinter import messagebox, StringVar, Toplevel, simpledialog
-from subprocess import Popen, CREATE_NEW_CONSOLE
+from subprocess import Popen
 from configparser import ConfigParser
 
+git=None # GitPython is imported by GitManager thread when needed, see GitManager._open_repo()
+async_git=None # asyncio git backend, imported together with GitPython
+CREATE_NEW_CONSOLE=getattr(subprocess, "CREATE_NEW_CONSOLE", 0) # Windows only, lets the module be imported elsewhere (e.g. benchmark.py)
+
+MAX_FETCH_REFSPECS=100 # above this many changed branches fall back to a single full fetch
+MIN_POLL_PERIOD=10 # shortest allowed polling period in seconds
+INSTANCE_PORT=47653 # local port held by the running instance of the application
+SETTINGS_CHECK_PERIOD=1.0 # seconds between checks of settings.ini modification time
+SETTINGS_WRITE_DELAY=0.5 # seconds to collect setting changes before writing settings.ini
+PATH_CHECK_TTL=300 # seconds a result of checking that a configured path exists is reused
+REF_WATCH_PERIOD=1.0 # seconds between checks of local refs for changes made by other tools
+MAIN_REPO="main" # name of the repository configured in [main] section of settings.ini
+REPO_SECTION_PREFIX="repo:" # sections of settings.ini configuring additional repositories, e.g. [repo:calibration]
+
+startup_marks=[] # (label, seconds since start) recorded by mark_startup()
+
+def mark_startup(label):
+    """
+    Record time elapsed since the start of the application
+    
+    Parameters
+    ----------
+    label : str
+        name of the start up step that has just finished
+    """
+    startup_marks.append((label, time.perf_counter()-STARTUP_T0))
+
+def write_startup_timing(file_path):
+    """
+    Append recorded start up timing marks to a log file
+    
+    Each run is written as a single JSON line with the marks in 
+    milliseconds since the start of the application.
+    
+    Parameters
+    ----------
+    file_path : str
+        path to the log file
+    """
+    with open(file_path, 'a') as f:
+        f.write(json.dumps({"time": time.time(), "marks_ms": [[label, round(elapsed*1000, 1)] for label, elapsed in startup_marks]})+"\n")
+
+GUI_DRAIN_PERIOD=100 # milliseconds between processing events from git manager in GUI thread
+GUI_PREFETCH_DELAY=400 # milliseconds a setup must stay selected before it is prefetched
+
+# GUI events posted from git manager thread to GitGui
+GUI_SETUPS_CHANGED="setups_changed"
+GUI_SETUP_LOADED="setup_loaded"
+GUI_ERROR="error"
+GUI_REMOTE_COMMAND="remote_command"
+GUI_SETUP_STATUS="setup_status"
+
+# commands accepted from other launches of the application, see InstanceServer
+IPC_LOAD="load"
+IPC_REFRESH="refresh"
+IPC_SHOW="show"
+GuiEvent=namedtuple("GuiEvent", ["kind", "payload", "created", "source"]) # created is time.monotonic(), source is name of posting thread
+
+# priorities of commands in GitManager queue, lower value is executed first
+PRIORITY_STOP=0
+PRIORITY_USER=1
+PRIORITY_POLL=2
+PRIORITY_PREFETCH=3
+
+SETUP_ADDED="added"
+SETUP_REMOVED="removed"
+SETUP_UPDATED="updated"
+SetupEvent=namedtuple("SetupEvent", ["kind", "name", "sha"]) # change of a single setup (branch) passed to GUI callback
+
+# state of the active setup reported to the status callback of GitManager
+STATUS_OK="ok" # same as on the server or fast-forwarded to it
+STATUS_DIRTY="dirty" # not updated, working tree has local changes
+STATUS_DIVERGED="diverged" # not updated, local branch has commits which are not on the server
+STATUS_DELETED="deleted" # branch has been deleted from the server, setup stays checked out
+STATUS_OFFLINE="offline" # server can not be reached
+STATUS_TIMEOUT="timeout" # not updated, checking the working tree took longer than the local timeout
+STATUS_BLOCKED="blocked" # not updated, fast-forward failed (untracked file in the way, index locked by another tool)
+STATUS_MESSAGES={STATUS_OK: "", STATUS_DIRTY: "has local changes, not updated", STATUS_DIVERGED: "has local commits, not updated",
+                 STATUS_DELETED: "was deleted from the server", STATUS_OFFLINE: "Git server not reachable", 
+                 STATUS_TIMEOUT: "could not be checked in time, not updated", 
+                 STATUS_BLOCKED: "could not be fast-forwarded (untracked files or locked), not updated"}
+
+def diff_setups(old_setups, new_setups):
+    """
+    Compare two setup snapshots and return list of changes
+    
+    Parameters
+    ----------
+    old_setups : dict
+        previous snapshot with branch name as a key and SHA as a value
+    new_setups : dict
+        current snapshot with branch name as a key and SHA as a value
+    
+    Returns
+    -------
+    list
+        list of SetupEvent tuples, empty if nothing changed
+    """
+    events=[]
+    for name, sha in new_setups.items():
+        old_sha=old_setups.get(name)
+        if old_sha is None:
+            events.append(SetupEvent(SETUP_ADDED, name, sha))
+        elif old_sha != sha:
+            events.append(SetupEvent(SETUP_UPDATED, name, sha))
+    for name, sha in old_setups.items():
+        if name not in new_setups:
+            events.append(SetupEvent(SETUP_REMOVED, name, sha))
+    return events
+
 class SettingsHandler(): # TODO: add docstrings to this class and methods
     """
     Read, write and verify settings for the application
@@ -15,13 +134,42 @@ class SettingsHandler(): # TODO: add docstrings to this class and methods
     from settings.ini file. Instance attributes are acessed directly
     using properties. Class instance is iterable to read and write
     settings in a loop.
+    
+    Settings are kept in memory and read again only when modification 
+    time of settings.ini changes (checked at most once per 
+    SETTINGS_CHECK_PERIOD). Results of checking that configured paths 
+    exist are reused for PATH_CHECK_TTL seconds, because on network
+    drives the check can take seconds. Changes are written to the file
+    by a background timer after SETTINGS_WRITE_DELAY, several changes
+    in a row are written once. The file is replaced atomically so it 
+    is never left half written. Other components can subscribe to be
+    notified about changed settings.
+    
+    Methods
+    -------
+    subscribe(callback)
+        Call the callback whenever a setting changes
+    check_for_changes()
+        Read settings.ini again if it was changed by someone else
+    flush()
+        Write pending changes to settings.ini now
+    repo_names()
+        Return names of additional repositories
     """
-    def __init__(self):
-        # retrieve settings from file and check that they are valid, if not valid then set them to None
-        self._settings_file=os.path.join(sys.path[0],'settings.ini')
+    def __init__(self, settings_file=None):
+        # retrieve settings from file and check that they are valid, if not valid then set them to None.
+        # Settings file is in the same folder as the main script unless specified otherwise
+        self._settings_file=settings_file if settings_file is not None else os.path.join(sys.path[0],'settings.ini')
+        self.section="main" # section with repository path and polling period, see RepoSettings
         self._attr_list=["repo_path", "wsl_path", "sftp_path", "timeout"]
+        self._lock=threading.RLock() # settings are used from GUI, git manager and write timer threads
+        self._subscribers=[]
+        self._path_checks={} # path -> (exists, time of the check)
+        self._write_timer=None
+        self._checked=time.monotonic()
         self.settings = ConfigParser()
-        self.settings.read(self._settings_file) # settings file is always in the same folder as the main script
+        self._mtime=self._file_mtime()
+        self.settings.read(self._settings_file)
     
     def __iter__(self):
         self.index=0 # reset the iteration index
@@ -37,69 +185,370 @@ class SettingsHandler(): # TODO: add docstrings to this class and methods
         
     @property
     def repo_path(self):
-        repo_path=self.settings.get('main','repo_path')
+        repo_path=self._get('main','repo_path')
         # check that path actually exists
-        if os.path.exists(repo_path) is False:
+        if self._path_exists(repo_path) is False:
             return '' # in case this path does not exist in this machine then return empty string
         else:
             return repo_path 
     
     @repo_path.setter
     def repo_path(self, path):
-        if os.path.exists(path) is False:
+        if self._path_exists(path, recheck=True) is False:
             raise ValueError("Specified repository path does not exist")
         else:
-            self.settings.set("main","repo_path",path)
-            self._write_to_file()
+            self._set("main","repo_path",path)
     
     @property
     def wsl_path(self):
-        wsl_path=self.settings.get('main','wsl_app_path')
+        wsl_path=self._get('main','wsl_app_path')
         # check that path actually exists
-        if os.path.exists(wsl_path[:-2]) is False: # remove tilde from the end of returned path string
+        if self._path_exists(wsl_path[:-2]) is False: # remove tilde from the end of returned path string
             return '' # in case this path does not exist in this machine then return empty string
         else:
             return wsl_path[:-2]
     
     @wsl_path.setter
     def wsl_path(self, path):
-        if os.path.exists(path) is False:
+        if self._path_exists(path, recheck=True) is False:
             raise ValueError("Specified WSL path does not exist")
         else:
-            self.settings.set("main","wsl_app_path",path+" ~") # append tilde so WSL would open up in home directory
-            self._write_to_file()
+            self._set("main","wsl_app_path",path+" ~") # append tilde so WSL would open up in home directory
             
     @property
     def sftp_path(self):
-        sftp_path=self.settings.get('main','sftp_path')
+        sftp_path=self._get('main','sftp_path')
         # check that path actually exists
-        if os.path.exists(sftp_path.split(',')[1]) is False: # remove explorer command from the start of string
+        if self._path_exists(sftp_path.split(',')[1]) is False: # remove explorer command from the start of string
             return '' # in case this path does not exist in this machine then return empty string
         else:
             return sftp_path.split(',')[1]
     
     @sftp_path.setter
     def sftp_path(self, path):
-        if os.path.exists(path) is False:
+        if self._path_exists(path, recheck=True) is False:
             raise ValueError("Specified SFTP path does not exist")
         else:
-            self.settings.set("main","sftp_path","explorer.exe /e,"+path) # prefix path with command to open up file explorer
-            self._write_to_file()
+            self._set("main","sftp_path","explorer.exe /e,"+path) # prefix path with command to open up file explorer
     
     @property
     def timeout(self):
-        return self.settings.getint('main','timeout')
+        return int(self._get('main','timeout'))
     
     @timeout.setter
     def timeout(self, timeout):
         if isinstance(timeout, int) is False:
             raise ValueError("Input timeout value must be integer")
-        self.settings.set("main","timeout",str(timeout))
-        self._write_to_file()
+        self._set("main","timeout",str(timeout))
+    
+    @property
+    def cache_file(self):
+        # last known list of setups, kept next to the settings file
+        return os.path.join(os.path.dirname(self._settings_file), "setups_cache.json")
+    
+    @property
+    def filter_file(self):
+        # rules for hiding setups, kept next to the settings file
+        return os.path.join(os.path.dirname(self._settings_file), "ignore_setups.txt")
+    
+    @property
+    def metrics_format(self):
+        # "jsonl", "prometheus" or empty to disable exporting metrics
+        return self._get('metrics','format',fallback='')
+    
+    @property
+    def metrics_path(self):
+        # file metrics are exported to, defaults to a file next to the settings file
+        metrics_path=self._get('metrics','path',fallback='')
+        if not metrics_path:
+            extension=".prom" if self.metrics_format == "prometheus" else ".jsonl"
+            return os.path.join(os.path.dirname(self._settings_file), "metrics"+extension)
+        return metrics_path
+    
+    @property
+    def api_port(self):
+        # local port of the JSON API in headless mode
+        return int(self._get('api','port',fallback=47654))
+    
+    @property
+    def max_timeout(self):
+        # longest polling period the scheduler backs off to while nothing changes on the server
+        return int(self._get('main','max_timeout',fallback=self.timeout*8))
+    
+    @property
+    def pool_size(self):
+        # number of warm worktrees to keep, 0 disables the worktree pool
+        return int(self._get('pool','size',fallback=0))
+    
+    @property
+    def pool_path(self):
+        # folder where pooled worktrees are created, defaults to a folder next to the repository
+        pool_path=self._get('pool','path',fallback='')
+        if not pool_path:
+            return self.repo_path.rstrip("\\/")+"_pool"
+        return pool_path
+    
+    @property
+    def pool_link(self):
+        # junction/symlink which always points to the worktree of the active setup
+        pool_link=self._get('pool','link',fallback='')
+        if not pool_link:
+            return os.path.join(self.pool_path, "active")
+        return pool_link
+    
+    @property
+    def watch_refs(self):
+        # refresh as soon as refs are changed by other tools (e.g. git fetch in a terminal)
+        return self._get('main','watch_refs',fallback='yes').lower() in ("1", "yes", "true", "on")
+    
+    @property
+    def webhook_port(self):
+        # port of the receiver of push webhooks from the git server, 0 disables it
+        return int(self._get('webhook','port',fallback=0))
+    
+    @property
+    def webhook_secret(self):
+        # token (GitLab) or signing secret (GitHub, Gitea) of the webhook, empty accepts any request
+        return self._get('webhook','secret',fallback='')
+    
+    @property
+    def fallback_timeout(self):
+        # polling period while webhooks are received, polling is only a fallback then
+        return int(self._get('webhook','fallback_timeout',fallback=600))
+    
+    @property
+    def campaign_path(self):
+        # folder with worktrees and logs of setup campaigns, defaults to a folder next to the repository
+        campaign_path=self._get('campaign','path',fallback='')
+        if not campaign_path:
+            return self.repo_path.rstrip("\\/")+"_campaign"
+        return campaign_path
+    
+    @property
+    def mirror_path(self):
+        # bare mirror of the git server shared with other machines, empty to fetch from the server directly
+        return self._get('mirror','path',fallback='')
+    
+    @property
+    def mirror_max_age(self):
+        # seconds a refresh of the mirror made by any machine is reused
+        return int(self._get('mirror','max_age',fallback=30))
+    
+    @property
+    def sparse_enabled(self):
+        # partial clone and per setup sparse checkout, see sparse_profiles.ini
+        return self._get('sparse','enabled',fallback='no').lower() in ("1", "yes", "true", "on")
+    
+    @property
+    def partial_clone_filter(self):
+        # objects left on the server until needed, empty to fetch everything
+        return self._get('sparse','filter',fallback='blob:none')
+    
+    @property
+    def sparse_file(self):
+        # folders checked out for each setup, kept next to the settings file
+        return os.path.join(os.path.dirname(self._settings_file), "sparse_profiles.ini")
+    
+    @property
+    def git_network_timeout(self):
+        # seconds after which a git command talking to the server (ls-remote, fetch, mirror refresh) is stopped
+        return int(self._get('git','network_timeout',fallback=300))
+    
+    @property
+    def git_local_timeout(self):
+        # seconds after which a read-only local git command (status, rev-parse) is stopped, checkout and merge have no limit
+        return int(self._get('git','local_timeout',fallback=120))
+    
+    @property
+    def max_git_processes(self):
+        # number of git processes run at the same time by all repositories
+        return max(int(self._get('git','max_processes',fallback=4)), 1)
+    
+    @property
+    def max_concurrent_polls(self):
+        # number of repositories allowed to talk to the git server at the same time
+        return max(int(self._get('main','max_concurrent_polls',fallback=4)), 1)
+    
+    def repo_names(self):
+        """
+        Return names of additional repositories
+        
+        Returns
+        -------
+        list
+            names of [repo:<name>] sections of settings.ini in file order
+        """
+        with self._lock:
+            return [section[len(REPO_SECTION_PREFIX):] for section in self.settings.sections() 
+                    if section.startswith(REPO_SECTION_PREFIX) and (section[len(REPO_SECTION_PREFIX):] != MAIN_REPO)]
+    
+    def subscribe(self, callback):
+        """
+        Call the callback whenever a setting changes
+        
+        Callback is called with section, option and new value (string
+        as written in settings.ini) from the thread which made the 
+        change or found out that the file has changed, so it must be
+        thread safe.
+        
+        Parameters
+        ----------
+        callback : function
+            called with section, option and value strings
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+    
+    def check_for_changes(self):
+        """
+        Read settings.ini again if it was changed by someone else
+        
+        Subscribers are notified about every changed setting.
+        """
+        changes=[]
+        with self._lock:
+            self._checked=time.monotonic()
+            mtime=self._file_mtime()
+            if (mtime == self._mtime) or (self._write_timer is not None): # unchanged or our own changes are pending
+                return
+            self._mtime=mtime
+            old_values={(section, option): value for section in self.settings.sections() for option, value in self.settings.items(section)}
+            self.settings=ConfigParser()
+            self.settings.read(self._settings_file)
+            for section in self.settings.sections():
+                for option, value in self.settings.items(section):
+                    if old_values.get((section, option)) != value:
+                        changes.append((section, option, value))
+            subscribers=list(self._subscribers)
+        for change in changes: # outside of the lock, subscribers may read other settings
+            for callback in subscribers:
+                callback(*change)
+    
+    def flush(self):
+        """
+        Write pending changes to settings.ini now
+        """
+        with self._lock:
+            if self._write_timer is None:
+                return
+            self._write_timer.cancel()
+            self._write_timer=None
+            tmp_file=self._settings_file+".tmp"
+            with open(tmp_file, 'w') as f:
+                self.settings.write(f)
+            os.replace(tmp_file, self._settings_file) # atomic, readers see either old or new file
+            self._mtime=self._file_mtime()
+    
+    def _file_mtime(self):
+        try:
+            return os.stat(self._settings_file).st_mtime_ns
+        except FileNotFoundError:
+            return None
+    
+    def _get(self, section, option, fallback=None):
+        # read a setting from memory, file is checked for changes at most once per SETTINGS_CHECK_PERIOD
+        if time.monotonic()-self._checked > SETTINGS_CHECK_PERIOD:
+            self.check_for_changes()
+        with self._lock:
+            if fallback is None:
+                return self.settings.get(section, option)
+            return self.settings.get(section, option, fallback=fallback)
+    
+    def _set(self, section, option, value):
+        # change a setting in memory, notify subscribers and schedule writing to file
+        with self._lock:
+            if not self.settings.has_section(section):
+                self.settings.add_section(section)
+            self.settings.set(section, option, value)
+            self._write_to_file()
+            subscribers=list(self._subscribers)
+        for callback in subscribers:
+            callback(section, option, value)
+    
+    def _path_exists(self, path, recheck=False):
+        # check that path exists, reuse result of a recent check unless recheck is requested
+        with self._lock:
+            check=self._path_checks.get(path)
+        if recheck or (check is None) or (time.monotonic()-check[1] > PATH_CHECK_TTL):
+            check=(os.path.exists(path), time.monotonic())
+            with self._lock:
+                self._path_checks[path]=check
+        return check[0]
     
     def _write_to_file(self):
-        with open(self._settings_file, 'w') as f:
-            self.settings.write(f)
+        # (re)start the timer which writes settings to file, so several changes in a row are written once
+        with self._lock:
+            if self._write_timer is not None:
+                self._write_timer.cancel()
+            self._write_timer=threading.Timer(SETTINGS_WRITE_DELAY, self.flush)
+            self._write_timer.daemon=True
+            self._write_timer.start()
+
+class RepoSettings():
+    """
+    Settings of an additional repository
+    
+    Repository path, polling periods and setups cache are read from the
+    [repo:<name>] section of settings.ini, everything else is shared 
+    with the main repository through its SettingsHandler. Worktree pool,
+    sparse mode, shared mirror and webhook receiver are only used by the
+    main repository.
+    """
+    def __init__(self, settings_ref, name):
+        """
+        Parameters
+        ----------
+        settings_ref : SettingsHandler
+            settings of the application
+        name : str
+            name of the repository, [repo:<name>] section of settings.ini
+        """
+        self._settings=settings_ref
+        self.name=name
+        self.section=REPO_SECTION_PREFIX+name
+    
+    def __getattr__(self, attr):
+        return getattr(self._settings, attr) # shared with the main repository
+    
+    @property
+    def repo_path(self):
+        repo_path=self._settings._get(self.section,'repo_path',fallback='')
+        if (not repo_path) or (self._settings._path_exists(repo_path) is False):
+            return '' # not configured or does not exist on this machine
+        return repo_path
+    
+    @property
+    def timeout(self):
+        return int(self._settings._get(self.section,'timeout',fallback=self._settings.timeout))
+    
+    @property
+    def max_timeout(self):
+        return int(self._settings._get(self.section,'max_timeout',fallback=self.timeout*8))
+    
+    @property
+    def cache_file(self):
+        return os.path.join(os.path.dirname(self._settings.cache_file), "setups_cache_{}.json".format(self.name))
+    
+    @property
+    def metrics_path(self):
+        root, extension=os.path.splitext(self._settings.metrics_path)
+        return "{}_{}{}".format(root, self.name, extension)
+    
+    @property
+    def pool_size(self):
+        return 0
+    
+    @property
+    def sparse_enabled(self):
+        return False
+    
+    @property
+    def mirror_path(self):
+        return ''
+    
+    @property
+    def webhook_port(self):
+        return 0
 
 class GitGui(tk.Tk):
     '''
@@ -109,43 +558,69 @@ class GitGui(tk.Tk):
     Starts running git_manager instance and provides callback functions for
     it. Manages the GUI.
     
+    Callback functions are safe to call from any thread: they only post
+    an event into a queue which is drained periodically in the tkinter
+    main loop. All setup changes drained at once are applied with a 
+    single widget refresh.
+    
+    With several repositories (see RepoHub) every repository has its own
+    setup picker, only the one of the repository selected in the 
+    repository list is shown. Active setups of the other repositories 
+    are listed below it. Git managers of all repositories report to the
+    same event queue, callbacks are bound to the repository name.
+    
     Methods
     -------
-    update_setups_list(setups_list)
-        Callback function to be provided for git_manager to call when new 
-        test setups (branches) are detected
+    update_setups_list(events, repo=MAIN_REPO)
+        Callback function to be provided for git_manager to call when 
+        test setups (branches) are added, removed or updated
     error_print(err_str)
         Callback function to be provided for git_manager to call when an
         exception is encountered while running git_manager thread.
-    setup_loaded(setup_name)
+    setup_loaded(setup_name, repo=MAIN_REPO)
         Callback function to be provided for git_manager to call when
         git_manager finishes loading new setup(branch)
+    setup_status(setup_name, status, repo=MAIN_REPO)
+        Callback function to be provided for git_manager to call when
+        the active setup could not be updated or is up to date again
+    handle_remote_command(command, argument)
+        Callback function to be provided for InstanceServer to call 
+        when a command is received from another launch of the 
+        application
     '''
 
-    def __init__(self, git_man, run_event, settings_ref): 
+    def __init__(self, hub, run_event, settings_ref): 
         """
         Parameters
         ----------
-        git_man : git_manager
-            Instance of git_manager providing backend
+        hub : RepoHub
+            git managers of all repositories providing backend
         run_event : threading.Event
             Event that signals when the application should shut down
         """
         tk.Tk.__init__(self)
         self._run_event=run_event
-        self._git_man=git_man
+        self._hub=hub
+        self._current_repo=MAIN_REPO # repository shown in the window
+        self._git_man=hub.managers[MAIN_REPO] # git manager of the shown repository
         self._settings=settings_ref
         self._wsl_path=self._settings.wsl_path
         self._sftp_path=self._settings.sftp_path
                
-        self._setups_list=[]
+        self._repo_setups={name: {} for name in hub.managers} # repository -> setups with branch name as a key and SHA as a value
+        self._setups=self._repo_setups[MAIN_REPO] # available setups of the shown repository
         self._active_setup=""
+        self._active_setups={name: "" for name in hub.managers} # repository -> active setup
+        self._setup_statuses={name: "" for name in hub.managers} # repository -> message about the active setup shown in the status line
+        self._loading=set() # repositories with a setup being loaded
+        self._events=queue.Queue() # GuiEvent tuples posted by other threads
+        self.event_latency=0.0 # seconds between posting and handling of the last drained event
         
         self.protocol("WM_DELETE_WINDOW", self._closed_std)
         self.title("MCP manager")
         self.resizable(False, False) # window size cannot be changed
         #self.iconbitmap(default=os.path.join(sys.path[0],"icons/mcp_icon.ico")) # look into same folder where the script is located        print("icon set")
-        self._frame=tk.Frame(master=self, width=400, height=160)
+        self._frame=tk.Frame(master=self, width=400, height=345)
         
         self._var_selected_setup=StringVar(master=self._frame)
         self._var_selected_setup.set(self._active_setup) # set the first setup as default setup
@@ -154,13 +629,18 @@ class GitGui(tk.Tk):
         
         self._label_setup_list_title=tk.Label(master=self._frame, text="SELECT SETUP", font=('Segoe UI', 10, 'bold'))
         self._label_setup_list_title.place(x=20,y=20)
-        self._list_selected_setup=ttk.Combobox(master=self._frame, textvariable=self._var_selected_setup, values=self._setups_list, width=30, state='disabled')
-        self._list_selected_setup.place(x=20,y=45)
+        self._pickers={} # repository -> SetupPicker, only the one of the shown repository is placed
+        for name in hub.managers:
+            self._pickers[name]=SetupPicker(master=self._frame, on_select=self._setup_selected, on_activate=self._load_setup)
+            self._pickers[name].set_enabled(False)
+        self._picker_setups=self._pickers[MAIN_REPO]
+        self._picker_setups.place(x=20,y=45)
+        self._prefetch_job=None # pending after() call which prefetches the selected setup
         
         self._label_active_setup_title=tk.Label(master=self._frame, text="ACTIVE SETUP", font=('Segoe UI', 10, 'bold'))
-        self._label_active_setup_title.place(x=20,y=75)
+        self._label_active_setup_title.place(x=20,y=245)
         self._label_active_setup=tk.Label(master=self._frame, textvariable=self._var_active_setup, font=('Segoe UI', 10), width=28, anchor="w") # it is empty when initialized
-        self._label_active_setup.place(x=20,y=100)
+        self._label_active_setup.place(x=20,y=270)
         
         self._button_load_setup=tk.Button(master=self._frame, text="Load setup", width=16, command=self._load_setup)
         self._button_load_setup["state"]="disabled"
@@ -169,6 +649,20 @@ class GitGui(tk.Tk):
         self._button_open_wsl.place(x=260, y=67)
         self._button_open_sftp=tk.Button(master=self._frame, text="Open SFTP folder", width=16, command=self._open_sftp)
         self._button_open_sftp.place(x=260, y=107)
+        self._var_repo=StringVar(master=self._frame)
+        self._var_repo.set(MAIN_REPO)
+        self._var_other_repos=StringVar(master=self._frame) # active setups of the repositories which are not shown
+        if len(hub.managers) > 1: # repository widgets only on stations with additional repositories
+            self._label_repo_title=tk.Label(master=self._frame, text="REPOSITORY", font=('Segoe UI', 10, 'bold'))
+            self._label_repo_title.place(x=260, y=150)
+            self._list_repos=ttk.Combobox(master=self._frame, textvariable=self._var_repo, values=list(hub.managers), width=15, state="readonly")
+            self._list_repos.place(x=260, y=175)
+            self._list_repos.bind("<<ComboboxSelected>>", self._repo_selected)
+            self._label_other_repos=tk.Label(master=self._frame, textvariable=self._var_other_repos, font=('Segoe UI', 8), justify="left", anchor="nw", width=20, height=5)
+            self._label_other_repos.place(x=260, y=205)
+        self._var_status=StringVar(master=self._frame)
+        self._label_status=tk.Label(master=self._frame, textvariable=self._var_status, font=('Segoe UI', 8), fg="gray40", anchor="w", width=60)
+        self._label_status.place(x=20, y=315)
         
         # create a menubar with sub-menus
         self._menubar = tk.Menu(master=self)
@@ -183,19 +677,34 @@ class GitGui(tk.Tk):
         
         self._filemenu.add_cascade(label="Set paths", menu=self._path_menu)
         self._menubar.add_cascade(label="Settings", menu=self._filemenu, underline=0)
+        self._menubar.add_command(label="Refresh", command=self._hub.refresh_now, underline=0)
         
         #self.pack()
         self._frame.pack()
-        self._git_man.start_updating(self.update_setups_list, self.error_print)
+        for name, git_man in hub.managers.items():
+            cache=git_man.get_cached_setups()
+            if cache is not None: # show setups from the previous run immediately, git manager reports any changes since then
+                self._repo_setups[name].update(cache["setups"])
+                self._pickers[name].apply_events([SetupEvent(SETUP_ADDED, setup_name, sha) for setup_name, sha in cache["setups"].items()])
+                self._on_setup_loaded(name, cache["active"])
+        self.after(GUI_DRAIN_PERIOD, self._drain_events)
+        self._update_status()
+        for name, git_man in hub.managers.items():
+            git_man.start_updating(functools.partial(self.update_setups_list, repo=name), self.error_print, 
+                                   functools.partial(self.setup_loaded, repo=name), functools.partial(self.setup_status, repo=name))
         
     def _closed_std(self):
         # This method is called by tkinter internal functions when a shutdown is started (pressing X)
         self._run_event.set()
+        self._hub.stop()
+        self._settings.flush()
         self.destroy()
         
     def _closed_err(self):
         # This method is called by tkinter internal functions when a shutdown is started by error handler
         self._run_event.set()
+        self._hub.stop()
+        self._settings.flush()
         self.quit()
     
     def _set_repo_path(self):
@@ -212,9 +721,7 @@ class GitGui(tk.Tk):
             
             break # if input valid then break 
         
-        # change the repo_path in git_manager instance as well - probably need to restart that insatnce or smth??
-        self._git_man.update_repo_path(path)
-        
+        # git_manager is subscribed to settings changes and switches to the new repository itself
     
     def _set_wsl_path(self):
         # method to set a new path pointing to WSL application
@@ -248,63 +755,180 @@ class GitGui(tk.Tk):
     
     def _set_poll_period(self):
         # method to set new polling period
-        timeout=int(simpledialog.askstring("Git polling period", "Please specify the interval for polling for new setups from Git server")) 
-        if timeout is None: # user aborted
-                    return
-        elif timeout < 10: # TODO: throw error window showing timeout limits to user
-            timeout = 0
-        self._settings.timeout=timeout
-        
-        # change the timeout value in git_manager instance
-        self._git_man.update_timeout(timeout)
+        while True:
+            timeout=simpledialog.askstring("Git polling period", "Please specify the interval for polling for new setups from Git server")
+            if timeout is None: # user aborted
+                return
+            try:
+                timeout=int(timeout)
+                if timeout < MIN_POLL_PERIOD:
+                    raise ValueError("Polling period too short")
+            except ValueError: # input invalid, continue asking until user specifies correct input
+                messagebox.showerror(title=None,message="Polling period must be an integer of at least {} seconds!".format(MIN_POLL_PERIOD))
+                continue
+            
+            break # if input valid then break 
+        self._settings.timeout=timeout # git_manager is subscribed to settings changes
             
-    def update_setups_list(self, setups_list):
+    def _post_event(self, kind, payload):
+        # thread safe: add event to the queue drained by tkinter main loop
+        self._events.put(GuiEvent(kind, payload, time.monotonic(), threading.current_thread().name))
+    
+    def _drain_events(self):
+        # Internal method run periodically in tkinter main loop, handles all
+        # events posted since the previous run. Setup changes are only
+        # collected and the widgets are updated once at the end
+        setup_events={} # repository -> SetupEvent tuples
+        while True:
+            try:
+                event=self._events.get_nowait()
+            except queue.Empty:
+                break
+            self.event_latency=time.monotonic()-event.created
+            self._git_man.metrics.observe("gui_event_latency", self.event_latency)
+            if event.kind == GUI_SETUPS_CHANGED:
+                repo, events=event.payload
+                setups=self._repo_setups[repo]
+                for setup_event in events:
+                    if setup_event.kind == SETUP_REMOVED:
+                        setups.pop(setup_event.name, None)
+                    else:
+                        setups[setup_event.name]=setup_event.sha
+                setup_events.setdefault(repo, []).extend(events)
+            elif event.kind == GUI_SETUP_LOADED:
+                self._on_setup_loaded(*event.payload)
+            elif event.kind == GUI_SETUP_STATUS:
+                self._on_setup_status(*event.payload)
+            elif event.kind == GUI_REMOTE_COMMAND:
+                self._run_remote_command(*event.payload)
+            elif event.kind == GUI_ERROR:
+                self._show_error(event.payload)
+                return # application is closing, do not schedule next run
+        for repo, events in setup_events.items():
+            with self._git_man.metrics.timed("gui_refresh"):
+                self._refresh_setups_list(repo, events)
+        self.after(GUI_DRAIN_PERIOD, self._drain_events)
+    
+    def _update_status(self):
+        # Internal method run every second to show duration and age of the last poll
+        last_poll=self._git_man.metrics.last("poll")
+        if last_poll is None:
+            status="Waiting for the first poll..."
+        else:
+            seconds, end=last_poll
+            status="Last poll took {:.2f} s, {:.0f} s ago".format(seconds, time.time()-end)
+        if self._setup_statuses[self._current_repo]:
+            status+=" | "+self._setup_statuses[self._current_repo]
+        self._var_status.set(status)
+        self.after(1000, self._update_status)
+    
+    def update_setups_list(self, events, repo=MAIN_REPO):
         """
-        Callback to call when new test setups (branches) are detected
+        Callback to call when test setups (branches) change
         
         This callback method must be provided to git_manager instance
-        which will call it whenever new branches (test setups) are 
-        found on the server. This method will update widgets in GUI
-        accordingly to show new available test setups.
+        which will call it whenever branches (test setups) are added,
+        removed or updated on the server. Widgets in GUI are updated 
+        accordingly in the tkinter main loop to show available test 
+        setups.
         
         Parameters
         ----------
-        setups_list : dict
-            dictionary containing available test setups with index 
-            number as a key
+        events : list
+            list of SetupEvent tuples describing the changes since 
+            the previous call
+        repo : str, optional
+            name of the repository the setups belong to
         """
-        list_of_setups=list(setups_list.values()) # convert dictionary into list
+        self._post_event(GUI_SETUPS_CHANGED, (repo, events))
+    
+    def _refresh_setups_list(self, repo, events):
+        # Internal method to apply setup changes to the widgets, only the 
+        # changed setups are added to or removed from the picker. The 
+        # active setup is never switched here, git manager reports a setup 
+        # deleted from the server with setup_status
+        self._pickers[repo].apply_events(events)
+        if (repo == self._current_repo) and (self._var_selected_setup.get() not in self._setups): # selected setup does not exist anymore
+            self._var_selected_setup.set(self._var_active_setup.get())
         
-        if self._var_selected_setup.get() not in list_of_setups: # if currently selected setup is not in the new list of setups
-            new_selected_setup=list_of_setups[0] # then it does not exist anymore, change selection to first setup in the list - actual change will be doen in the end
-        else:
-            new_selected_setup=self._var_selected_setup.get()
-            
-        if not self._var_active_setup.get(): # if empty string then starting up, load the currently selected branch
-            new_selected_setup=self._git_man.get_active_setup()
+    def handle_remote_command(self, command, argument):
+        """
+        Callback to call when a command is received from another launch
         
-        if self._var_active_setup.get() not in list_of_setups: # if currently active setup is not in the new list of setups
-            self._load_setup(new_selected_setup) # then switch to another setup (the one currently selected)
+        This callback method must be provided to InstanceServer which 
+        calls it from its own thread. The command is executed in the 
+        tkinter main loop.
         
-        self._list_selected_setup['values']=list_of_setups 
+        Parameters
+        ----------
+        command : str
+            one of IPC_LOAD, IPC_REFRESH or IPC_SHOW
+        argument : str
+            setup name for IPC_LOAD, otherwise empty string
         
+        Raises
+        ------
+        KeyError
+            IPC_LOAD of a setup which does not exist in the main 
+            repository
+        """
+        if (command == IPC_LOAD) and (argument not in self._repo_setups[MAIN_REPO]):
+            raise KeyError(argument)
+        self._post_event(GUI_REMOTE_COMMAND, (command, argument))
+    
+    def _run_remote_command(self, command, argument):
+        # Internal method to execute command received from another launch, 
+        # setups are always loaded in the main repository
+        if command == IPC_LOAD:
+            if argument in self._repo_setups[MAIN_REPO]:
+                self._var_repo.set(MAIN_REPO)
+                self._repo_selected()
+                self._load_setup(argument)
+        elif command == IPC_REFRESH:
+            self._hub.refresh_now()
+        elif command == IPC_SHOW:
+            self.deiconify()
+            self.lift()
+            self.focus_force()
+    
     def error_print(self, err_str):
         """
         Callback to call when exception is raised
         
         This callback method must be provided to git_manager instance
         which will call it whenever there is an exception raised while
-        executing the thread run method. This method creates a pop-up
-        window which displays the exception message for the user.
+        executing the thread run method. A pop-up window which displays
+        the exception message for the user is created in the tkinter 
+        main loop.
         
         Parameters
         ----------
         err_str : str
             string containing traceback of the exception
         """
+        self._post_event(GUI_ERROR, err_str)
+    
+    def _show_error(self, err_str):
+        # Internal method to show the exception and close the application
         messagebox.showerror(title="Exception raised",message=err_str)
         self._closed_err()
     
+    def _setup_selected(self, setup_name):
+        # Internal method called when user picks a setup from the list. The 
+        # setup is prefetched once the selection has settled, so scrolling 
+        # through the list does not start a fetch for every setup
+        self._var_selected_setup.set(setup_name)
+        if self._prefetch_job is not None:
+            self.after_cancel(self._prefetch_job)
+        self._prefetch_job=self.after(GUI_PREFETCH_DELAY, self._prefetch_selected)
+    
+    def _prefetch_selected(self):
+        # Internal method to prefetch the setup which is selected but not loaded yet
+        self._prefetch_job=None
+        selected_setup=self._var_selected_setup.get()
+        if selected_setup != self._var_active_setup.get():
+            self._git_man.prefetch_setup(selected_setup)
+    
     def _load_setup(self, new_setup=None):
         # Internal method that is called when a new test setup (branch) needs
         # to be loaded
@@ -313,10 +937,11 @@ class GitGui(tk.Tk):
         else:
             selected_setup=new_setup
         self._button_load_setup["state"]="disabled"
-        self._list_selected_setup["state"]="disabled"
-        threading.Thread(target=self._git_man.load_setup, args=(selected_setup, self.setup_loaded)).start() # this implemented in a thread with callback function
+        self._picker_setups.set_enabled(False)
+        self._loading.add(self._current_repo)
+        self._git_man.load_setup(selected_setup, functools.partial(self.setup_loaded, repo=self._current_repo)) # queued to git manager thread, callback is called when done
     
-    def setup_loaded(self, setup_name):
+    def setup_loaded(self, setup_name, repo=MAIN_REPO):
         """
         Callback function when new setup is loaded
         
@@ -329,11 +954,74 @@ class GitGui(tk.Tk):
         ----------
         setup_name : str
             string containing the steup name that was loaded
+        repo : str, optional
+            name of the repository the setup belongs to
         """
-        self._var_active_setup.set(setup_name)
-        self._var_selected_setup.set(setup_name)
-        self._button_load_setup["state"]="normal"
-        self._list_selected_setup["state"]="readonly"
+        self._post_event(GUI_SETUP_LOADED, (repo, setup_name))
+    
+    def setup_status(self, setup_name, status, repo=MAIN_REPO):
+        """
+        Callback function when state of the active setup changes
+        
+        This callback method must be provided to git_manager instance
+        which calls it when the active setup could not be updated to 
+        the latest commit on the server (or is up to date again). The
+        state is shown in the status line.
+        
+        Parameters
+        ----------
+        setup_name : str
+            name of the active setup
+        status : str
+            one of STATUS_OK, STATUS_DIRTY, STATUS_DIVERGED, 
+            STATUS_DELETED or STATUS_OFFLINE
+        repo : str, optional
+            name of the repository the setup belongs to
+        """
+        self._post_event(GUI_SETUP_STATUS, (repo, setup_name, status))
+    
+    def _on_setup_status(self, repo, setup_name, status):
+        # Internal method to remember the message shown in the status line
+        if status in (STATUS_OK, STATUS_OFFLINE):
+            self._setup_statuses[repo]=STATUS_MESSAGES[status]
+        else:
+            self._setup_statuses[repo]="{} {}".format(setup_name, STATUS_MESSAGES[status])
+    
+    def _on_setup_loaded(self, repo, setup_name):
+        # Internal method to update widgets once the setup is loaded
+        self._active_setups[repo]=setup_name
+        self._loading.discard(repo)
+        self._pickers[repo].set_enabled(True)
+        self._pickers[repo].reveal(setup_name)
+        if repo == self._current_repo:
+            self._var_active_setup.set(setup_name)
+            self._var_selected_setup.set(setup_name)
+            self._button_load_setup["state"]="normal"
+        self._show_other_repos()
+    
+    def _repo_selected(self, event=None):
+        # Internal method to show setups of the repository selected in the repository list
+        name=self._var_repo.get()
+        if name == self._current_repo:
+            return
+        if self._prefetch_job is not None: # selection in the previous repository
+            self.after_cancel(self._prefetch_job)
+            self._prefetch_job=None
+        self._picker_setups.place_forget()
+        self._current_repo=name
+        self._git_man=self._hub.managers[name]
+        self._setups=self._repo_setups[name]
+        self._picker_setups=self._pickers[name]
+        self._picker_setups.place(x=20,y=45)
+        self._var_active_setup.set(self._active_setups[name])
+        self._var_selected_setup.set(self._active_setups[name])
+        self._button_load_setup["state"]="disabled" if (name in self._loading) or (not self._active_setups[name]) else "normal"
+        self._show_other_repos()
+    
+    def _show_other_repos(self):
+        # Internal method to list active setups of the repositories which are not shown
+        self._var_other_repos.set("\n".join("{}: {}".format(name, setup_name or "-") for name, setup_name in self._active_setups.items() 
+                                            if name != self._current_repo))
     
     def _open_wsl(self):
         # Internal method to open up a WSL terminal
@@ -344,6 +1032,432 @@ class GitGui(tk.Tk):
         Popen(r"explorer.exe /e,"+self._sftp_path, creationflags=CREATE_NEW_CONSOLE) # TODO: attribute retrieval should already contain the required commands
 
 
+class RefIndex():
+    """
+    Index of remote branches read directly from the git directory
+    
+    Reads loose refs and packed-refs file of the repository without
+    spawning git or creating GitPython reference objects. Parsed 
+    packed-refs file is cached until the file changes on disk.
+    
+    Methods
+    -------
+    read()
+        Return dictionary of remote branches and their SHAs
+    """
+    def __init__(self, git_dir, remote="origin"):
+        """
+        Parameters
+        ----------
+        git_dir : str
+            path to the (common) git directory of the repository
+        remote : str, optional
+            name of the remote which branches are indexed
+        """
+        self._git_dir=git_dir
+        self._prefix="refs/remotes/"+remote+"/"
+        self._loose_root=os.path.join(git_dir, "refs", "remotes", remote)
+        self._packed_stat=None
+        self._packed_refs={}
+    
+    def read(self):
+        """
+        Return dictionary of remote branches and their SHAs
+        
+        Loose refs take precedence over packed refs because git 
+        writes updated refs as loose files. Symbolic refs (e.g. 
+        origin/HEAD) and lock files left behind by an interrupted fetch
+        are skipped.
+        
+        Returns
+        -------
+        dict
+            dictionary with branch name as a key and SHA as a value
+        """
+        refs=dict(self._read_packed())
+        for dirpath, dirnames, filenames in os.walk(self._loose_root):
+            for filename in filenames:
+                if filename.endswith(".lock"): # ref being written or left behind by an interrupted fetch, never a branch
+                    continue
+                path=os.path.join(dirpath, filename)
+                try:
+                    with open(path) as f:
+                        content=f.read().strip()
+                except OSError: # ref was removed or is being written right now
+                    continue
+                if content.startswith("ref:"): # symbolic ref, e.g. origin/HEAD
+                    continue
+                refs[os.path.relpath(path, self._loose_root).replace(os.sep, "/")]=content
+        return refs
+    
+    def _read_packed(self):
+        # parse packed-refs file, reuse previous result if the file has not changed
+        path=os.path.join(self._git_dir, "packed-refs")
+        try:
+            stat=os.stat(path)
+        except FileNotFoundError:
+            self._packed_stat=None
+            self._packed_refs={}
+            return self._packed_refs
+        if (stat.st_mtime_ns, stat.st_size) != self._packed_stat:
+            packed_refs={}
+            with open(path) as f:
+                for line in f:
+                    if line.startswith(("#", "^")): # header or peeled tag line
+                        continue
+                    sha, ref=line.rstrip("\n").split(" ", 1)
+                    if ref.startswith(self._prefix) and ref != self._prefix+"HEAD":
+                        packed_refs[ref[len(self._prefix):]]=sha
+            self._packed_refs=packed_refs
+            self._packed_stat=(stat.st_mtime_ns, stat.st_size)
+        return self._packed_refs
+
+
+class RefWatcher():
+    """
+    Detect changes of local refs made by other tools
+    
+    Compares modification times of HEAD, packed-refs and of every 
+    folder under refs against a baseline. Git writes a ref to a lock 
+    file and renames it, which changes the modification time of the 
+    folder, so individual ref files do not have to be checked. The 
+    list of folders is only scanned again when one of them changes.
+    
+    Methods
+    -------
+    changed()
+        Check if anything changed since the baseline
+    rebaseline()
+        Accept the current state as the baseline
+    """
+    def __init__(self, git_dir, common_dir):
+        """
+        Parameters
+        ----------
+        git_dir : str
+            git directory of the repository (contains HEAD)
+        common_dir : str
+            git directory shared by all worktrees (contains refs)
+        """
+        self._files=[os.path.join(git_dir, "HEAD"), os.path.join(common_dir, "packed-refs")]
+        self._refs_path=os.path.join(common_dir, "refs")
+        self._folders=[]
+        self._baseline=None
+        self.rebaseline()
+    
+    def _snapshot(self):
+        # modification times of the watched files and folders
+        snapshot=[]
+        for path in self._files+self._folders:
+            try:
+                snapshot.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                snapshot.append(None)
+        return snapshot
+    
+    def changed(self):
+        """
+        Check if anything changed since the baseline
+        
+        Returns
+        -------
+        boolean
+            True if a ref was added, moved or deleted
+        """
+        return self._snapshot() != self._baseline
+    
+    def rebaseline(self):
+        """
+        Accept the current state as the baseline
+        
+        Called after the git manager's own git commands so they do not 
+        trigger a refresh.
+        """
+        snapshot=self._snapshot()
+        if snapshot != self._baseline: # a folder may have been added or removed
+            self._folders=[folder for folder, subfolders, files in os.walk(self._refs_path)]
+            snapshot=self._snapshot()
+        self._baseline=snapshot
+
+
+class WorktreePool():
+    """
+    Pool of pre-materialized worktrees for recently used setups
+    
+    Keeps up to size worktrees (each with one setup checked out as a
+    detached HEAD) in the pool folder and a junction (Windows) or 
+    symlink pointing to the worktree of the active setup. Switching to
+    a setup which is already in the pool only updates the link. Least
+    recently used worktree is removed when the pool is full.
+    
+    Methods
+    -------
+    activate(setup_name)
+        Make the setup active, materializing it if needed
+    prepare(setup_name)
+        Materialize or update worktree of the setup without activating it
+    has_free_slot()
+        Check if a worktree can be added without evicting another one
+    update(setup_name)
+        Move pooled worktree of the setup to the latest remote commit
+    """
+    def __init__(self, repo, pool_path, link_path, size, sparse=None):
+        """
+        Parameters
+        ----------
+        repo : git.Repo
+            repository which worktrees are added to
+        pool_path : str
+            folder where the worktrees are created
+        link_path : str
+            path of the link pointing to the active worktree
+        size : int
+            maximum number of worktrees kept in the pool
+        sparse : SparseProfiles, optional
+            folders checked out in the worktree of each setup, whole 
+            tree if not given
+        """
+        self._repo=repo
+        self._sparse=sparse
+        self._pool_path=pool_path
+        self._link_path=link_path
+        self._size=max(size, 1)
+        self._worktrees=OrderedDict() # setup name -> worktree path, least recently used first
+        self.active=None
+        os.makedirs(self._pool_path, exist_ok=True)
+        self._scan()
+    
+    def _scan(self):
+        # pick up worktrees created by previous runs of the application
+        self._repo.git.worktree("prune")
+        pool_root=os.path.normcase(os.path.abspath(self._pool_path))
+        for line in self._repo.git.worktree("list", "--porcelain").splitlines():
+            if not line.startswith("worktree "):
+                continue
+            path=os.path.abspath(line[len("worktree "):])
+            if os.path.normcase(os.path.dirname(path)) == pool_root:
+                self._worktrees[self._setup_name(path)]=path
+        if not os.path.lexists(self._link_path): # link does not exist yet
+            return
+        target=os.path.normcase(os.path.realpath(self._link_path)) # readlink of a junction returns a \\?\ path on Windows, compare resolved paths
+        for setup_name, path in self._worktrees.items():
+            if os.path.normcase(os.path.realpath(path)) == target:
+                self.active=setup_name
+                self._worktrees.move_to_end(setup_name)
+    
+    def _worktree_path(self, setup_name):
+        # branch names may contain slashes and characters not allowed in 
+        # Windows file names, worktrees are kept flat in the pool folder 
+        # under the percent-encoded name, which can be decoded back
+        return os.path.join(self._pool_path, urllib.parse.quote(setup_name, safe=""))
+    
+    def _setup_name(self, path):
+        return urllib.parse.unquote(os.path.basename(path))
+    
+    def __contains__(self, setup_name):
+        return setup_name in self._worktrees
+    
+    def path(self, setup_name):
+        # path of the pooled worktree of the setup
+        return self._worktrees[setup_name]
+    
+    def activate(self, setup_name):
+        """
+        Make the setup active, materializing it if needed
+        
+        Parameters
+        ----------
+        setup_name : str
+            the name of the branch to switch to
+        
+        Returns
+        -------
+        str
+            path of the worktree with the setup checked out
+        """
+        path=self.prepare(setup_name)
+        self._point_link(path)
+        self.active=setup_name
+        return path
+    
+    def prepare(self, setup_name):
+        """
+        Materialize or update worktree of the setup without activating it
+        
+        Parameters
+        ----------
+        setup_name : str
+            the name of the branch
+        
+        Returns
+        -------
+        str
+            path of the worktree with the setup checked out
+        """
+        return self.update(setup_name) if setup_name in self._worktrees else self._add(setup_name)
+    
+    def has_free_slot(self):
+        """
+        Check if a worktree can be added without evicting another one
+        
+        Returns
+        -------
+        boolean
+            True if the pool is not full
+        """
+        return len(self._worktrees) < self._size
+    
+    def update(self, setup_name):
+        """
+        Move pooled worktree of the setup to the latest remote commit
+        
+        Parameters
+        ----------
+        setup_name : str
+            the name of the pooled branch
+        
+        Returns
+        -------
+        str
+            path of the worktree
+        """
+        path=self._worktrees[setup_name]
+        patterns_changed=(self._sparse is not None) and self._sparse.apply(self._git_dir(path), setup_name)
+        self._repo.git.execute(["git", "-C", path, "checkout", "--detach", "origin/"+setup_name])
+        if patterns_changed: # checkout only follows new patterns for files it changes
+            self._repo.git.execute(["git", "-C", path, "sparse-checkout", "reapply"])
+        self._worktrees.move_to_end(setup_name)
+        return path
+    
+    def remove(self, setup_name):
+        # remove the worktree of the setup from the pool
+        path=self._worktrees.pop(setup_name)
+        self._repo.git.worktree("remove", "--force", path)
+    
+    def _add(self, setup_name):
+        # materialize a new worktree, evicting least recently used one if the pool is full
+        while len(self._worktrees) >= self._size:
+            evicted=next((name for name in self._worktrees if name != self.active), None)
+            if evicted is None: # only the active setup is left, it can not be removed
+                break
+            self.remove(evicted)
+        path=self._worktree_path(setup_name)
+        if self._sparse is None:
+            self._repo.git.worktree("add", "--detach", path, "origin/"+setup_name)
+        else: # write the patterns before any file is checked out
+            self._repo.git.worktree("add", "--no-checkout", "--detach", path, "origin/"+setup_name)
+            self._sparse.apply(self._git_dir(path), setup_name)
+            self._repo.git.execute(["git", "-C", path, "checkout", "--detach", "origin/"+setup_name])
+        self._worktrees[setup_name]=path
+        return path
+    
+    def _git_dir(self, path):
+        # private git directory of the worktree (.git of a worktree is only a file pointing to it)
+        return self._repo.git.execute(["git", "-C", path, "rev-parse", "--absolute-git-dir"])
+    
+    def _point_link(self, target):
+        # swap the link to point to another worktree, only the link is rewritten
+        if os.name == "nt": # junctions do not need admin rights but can not be replaced atomically
+            if os.path.lexists(self._link_path):
+                os.rmdir(self._link_path) # removes only the junction, not the target folder
+            subprocess.run(["cmd", "/c", "mklink", "/J", self._link_path, target], check=True, capture_output=True)
+        else:
+            tmp_link=self._link_path+".tmp"
+            if os.path.lexists(tmp_link):
+                os.remove(tmp_link)
+            os.symlink(target, tmp_link, target_is_directory=True)
+            os.replace(tmp_link, self._link_path)
+
+
+class PollScheduler():
+    """
+    Compute waiting time between polls of the git server
+    
+    Polling period starts at the base period and is multiplied by 
+    backoff factor after every poll that found no changes, up to the
+    maximum period. A poll that found changes resets the period back
+    to the base. Every delay is randomized by +-jitter fraction using a
+    random generator seeded with the host name, so that machines in the
+    lab started at the same time drift apart instead of polling in 
+    lockstep.
+    
+    Methods
+    -------
+    next_delay()
+        Return seconds to wait before the next poll
+    record(changed)
+        Adjust polling period after a poll
+    reset()
+        Go back to the base polling period
+    update_period(base_period, max_period)
+        Change base and maximum polling period
+    """
+    def __init__(self, base_period, max_period, backoff=2.0, jitter=0.2):
+        """
+        Parameters
+        ----------
+        base_period : int
+            polling period in seconds used after a change was detected
+        max_period : int
+            longest polling period in seconds while nothing changes
+        backoff : float, optional
+            factor the period is multiplied with after a poll without 
+            changes
+        jitter : float, optional
+            fraction of the period used for randomizing each delay
+        """
+        self._backoff=backoff
+        self._jitter=jitter
+        self._random=random.Random(zlib.crc32(socket.gethostname().encode())) # different sequence on every host
+        self.update_period(base_period, max_period)
+    
+    def update_period(self, base_period, max_period):
+        """
+        Change base and maximum polling period
+        
+        Parameters
+        ----------
+        base_period : int
+            polling period in seconds used after a change was detected
+        max_period : int
+            longest polling period in seconds while nothing changes
+        """
+        self._base_period=max(base_period, MIN_POLL_PERIOD)
+        self._max_period=max(max_period, self._base_period)
+        self._period=self._base_period
+    
+    def reset(self):
+        """
+        Go back to the base polling period
+        """
+        self._period=self._base_period
+    
+    def record(self, changed):
+        """
+        Adjust polling period after a poll
+        
+        Parameters
+        ----------
+        changed : boolean
+            True if the poll detected changes on the server
+        """
+        if changed:
+            self._period=self._base_period
+        else:
+            self._period=min(self._period*self._backoff, self._max_period)
+    
+    def next_delay(self):
+        """
+        Return seconds to wait before the next poll
+        
+        Returns
+        -------
+        float
+            randomized delay in seconds
+        """
+        return self._period*(1+self._jitter*(2*self._random.random()-1))
+
+
 class GitManager(threading.Thread):
     """
     Backend to manage git repositories
@@ -355,79 +1469,465 @@ class GitManager(threading.Thread):
     periodically checks for new branches on the git server and pull
     any changes for the existing branches.
     
+    The thread is the only one running git commands. Requests from 
+    other threads are put into a priority queue, so user initiated 
+    commands (e.g. loading a setup) are executed before a queued poll
+    and a poll that has not started fetching yet is deferred until the
+    user commands are done. Repeated refresh requests are coalesced 
+    into a single poll.
+    
+    Several git managers (one per repository, see RepoHub) can share a
+    semaphore limiting how many of them list and fetch branches from
+    the git server at the same time.
+    
+    Git commands are run as asyncio subprocesses by the runner shared 
+    by all git managers (see async_git), the thread only waits for 
+    their results. Commands talking to the server and read-only local
+    commands are stopped after the network or local timeout from 
+    settings and as soon as stop() is called, so a hung server never
+    freezes polling or shutdown. Commands changing the working tree 
+    (checkout, merge) always run to the end.
+    
     Methods
     -------
     get_active_setup()
         Return the branch name which is currently checked out
-    load_setup(setup_name, callback_func=None, lock_aquired=False)
+    get_cached_setups()
+        Return setups saved to disk by the previous run
+    load_setup(setup_name, callback_func=None)
         Switch to new branch
-    start_updating(callback, err_callback)(setup_name)
+    prefetch_setup(setup_name)
+        Fetch the branch in background before it is loaded
+    start_updating(callback, err_callback, loaded_callback=None, status_callback=None)
         Setup callback functions and start git manager thread
+    refresh_now()
+        Poll the git server immediately
+    stop()
+        Stop the polling thread
     """
     
-    def __init__(self, run_flag, settings_ref):
+    def __init__(self, run_flag, settings_ref, network_slots=None):
         """
         Parameters
         ----------
-        repo_path : str
-            specify the path to the local git repository
         run_flag : threading.Event
             event flag to signal when user has closed GUI
-        timeout : int
-            time to wait between retrieving new information from git 
-            server
+        settings_ref : SettingsHandler or RepoSettings
+            settings of the application (repository path, polling 
+            period etc.)
+        network_slots : threading.BoundedSemaphore, optional
+            held while listing and fetching branches, shared by git 
+            managers of all repositories
         """
         self._settings=settings_ref
-        self._timeout=self._settings.timeout 
+        self._network_slots=network_slots if network_slots is not None else contextlib.nullcontext()
+        self._scheduler=PollScheduler(self._base_period(self._settings.timeout), self._settings.max_timeout)
+        self._commands=queue.PriorityQueue() # (priority, order, function, arguments), function None means poll
+        self._order=itertools.count() # keeps commands with the same priority in FIFO order
+        self._poll_queued=threading.Event() # set while a requested poll is waiting in the queue
+        self._prefetch_queued=threading.Event() # set while a prefetch is waiting in the queue
+        self._prefetch_target=None # setup to prefetch, only the latest request is kept
         self._repo_path=self._settings.repo_path
-        os.chdir(self._repo_path) # switch to directory where the repository is located
-        self._repo=git.Repo(self._repo_path)
+        self._filter=SetupFilter(self._settings.filter_file)
+        self.metrics=Metrics(self._settings.metrics_format, self._settings.metrics_path)
+        self._repo=None # opened by the thread, see _open_repo()
+        self._git_runner=None # AsyncGit running git commands, see _git()
+        self._ref_index=None
+        self._pool=None
+        self._sparse=None # SparseProfiles when sparse mode is enabled, see _configure_sparse()
+        self._ref_watcher=None # RefWatcher when watching local refs is enabled
+        self._mirror=None # SharedMirror when mirror mode is enabled
+        self._webhook=None # webhook receiver started by the thread, see _start_webhook()
         self._run_flag=run_flag
         self._setups={}
-        self._lock=threading.Lock()
+        self._remote_refs=None # snapshot of branch names and SHAs on the server from the last poll
+        self._cache=self._read_cache()
+        if self._cache is not None: # first poll only reports changes since the previous run
+            self._setups=dict(self._cache["setups"])
+            self._active_setup=self._cache["active"]
+        else:
+            self._active_setup=None # last active setup reported to the callbacks
+        self._status=None # (active setup, STATUS_*) last reported to the status callback
+        self.loaded_callback=None
+        self.status_callback=None
+        self._settings.subscribe(self._setting_changed)
         threading.Thread.__init__(self)
         
+    def _open_repo(self):
+        # import GitPython and open the repository, done in git manager 
+        # thread so the window can be shown before the git backend is loaded
+        global git, async_git
+        import git
+        import async_git
+        self._git_runner=async_git.shared_runner(self._settings.max_git_processes)
+        self._repo=git.Repo(self._repo_path) # commands run in the repository, the process never changes its folder (several repositories)
+        self._ref_index=RefIndex(self._repo.common_dir)
+        self._mirror=self._create_mirror()
+        self._configure_sparse()
+        self._pool=self._create_pool()
+        self._ref_watcher=RefWatcher(self._repo.git_dir, self._repo.common_dir) if self._settings.watch_refs else None
+    
+    def _create_mirror(self):
+        # open the shared mirror if it is enabled in settings. It is created 
+        # and the repository starts borrowing its objects in _ls_remote(), 
+        # so a slow or failing clone is reported as offline. The initial 
+        # clone of a big repository can take longer than the network timeout
+        if not self._settings.mirror_path:
+            return None
+        return SharedMirror(lambda *args: self._git(*args, network=True).stdout, self._settings.mirror_path, self._repo.remotes.origin.url, 
+                            run_clone=lambda *args: self._git(*args, network=True, unlimited=True).stdout)
+    
+    def _fetch_source(self):
+        # where branches are listed and fetched from, the mirror replaces the server in mirror mode
+        return "origin" if self._mirror is None else self._mirror.path
+    
+    def _start_webhook(self):
+        # start receiver of push webhooks if it is enabled in settings, 
+        # imported only then to keep http.server out of start up
+        if self._settings.webhook_port <= 0:
+            return
+        import webhook
+        self._webhook=webhook.WebhookServer(self._settings.webhook_port, self._settings.webhook_secret, self.refresh_now)
+        self._webhook.start()
+    
+    def _base_period(self, timeout):
+        # polling period, polling is only a fallback when webhooks are received
+        if self._settings.webhook_port > 0:
+            return max(timeout, self._settings.fallback_timeout)
+        return timeout
+    
+    def _create_pool(self):
+        # create worktree pool if it is enabled in settings
+        if self._settings.pool_size <= 0:
+            return None
+        return WorktreePool(self._repo, self._settings.pool_path, self._settings.pool_link, self._settings.pool_size, self._sparse)
+    
+    def _configure_sparse(self):
+        # turn the repository into a partial clone with cone mode sparse 
+        # checkout if sparse mode is enabled in settings. Fetches then 
+        # leave file contents on the server and checkouts download only
+        # the files of the folders in the profile of the setup
+        if not self._settings.sparse_enabled:
+            self._sparse=None
+            if self._git_in(self._repo.working_dir, "config", "--bool", "mcp.sparseMode")[1] == "true": # turned off, sparse checkouts set up by hand are left alone
+                self._disable_sparse_checkout()
+            return
+        self._sparse=SparseProfiles(self._settings.sparse_file)
+        partial_filter=self._settings.partial_clone_filter
+        if partial_filter:
+            self._git("config", "core.repositoryformatversion", "1", writes=True) # required by the extension below
+            self._git("config", "extensions.partialClone", "origin", writes=True)
+            self._git("config", "remote.origin.promisor", "true", writes=True)
+            self._git("config", "remote.origin.partialclonefilter", partial_filter, writes=True)
+        self._git("config", "core.sparseCheckout", "true", writes=True)
+        self._git("config", "core.sparseCheckoutCone", "true", writes=True)
+        self._git("config", "mcp.sparseMode", "true", writes=True) # marks sparse checkout set up by this application
+        self._update_sparse_checkout()
+    
+    def _disable_sparse_checkout(self):
+        # check out the whole tree again in the repository and its worktrees 
+        # (worktree pool), otherwise checkouts keep following the patterns 
+        # of the last setup. The partial clone settings are kept, missing 
+        # file contents are downloaded when checked out
+        for line in self._git("worktree", "list", "--porcelain").stdout.splitlines():
+            if line.startswith("worktree ") and os.path.isdir(line[len("worktree "):]):
+                self._git("sparse-checkout", "disable", cwd=line[len("worktree "):], writes=True)
+        self._git("config", "--unset", "mcp.sparseMode", writes=True)
+    
+    def _update_sparse_checkout(self):
+        # make the working tree follow the profile of the active setup, 
+        # e.g. when sparse_profiles.ini was edited. Pooled worktrees are 
+        # updated when they are activated
+        if (self._settings.pool_size <= 0) and self._sparse.apply(self._repo.git_dir, self.get_active_setup()):
+            self._git("sparse-checkout", "reapply", writes=True)
+    
     def run(self):
-        # internal function for threading - this will be run when start() method is called
+        # internal function for threading - this will be run when start() method is called.
+        # Executes queued commands in priority order and polls the server
+        # whenever the queue stays empty for the polling period or local 
+        # refs were changed by another tool
+        try:
+            self._open_repo()
+            self._start_webhook()
+            mark_startup("git backend loaded")
+        except:
+            self.err_callback(traceback.format_exc())
+            return
+        next_poll=time.monotonic() # poll immediately at start up
+        first_poll=True
         while not self._run_flag.is_set(): # while GUI has not been closed
+            timeout=max(next_poll-time.monotonic(), 0)
+            if self._ref_watcher is not None:
+                timeout=min(timeout, REF_WATCH_PERIOD)
             try:
-                self._lock.acquire()
-                self._prune_refs()
-                new_setups=self._get_setups() # get the list of all branches/setups
-                self._lock.release()
-                if new_setups != self._setups:
-                    self.callback(new_setups)
-                    self._setups=new_setups
+                priority, order, func, args=self._commands.get(timeout=timeout)
+            except queue.Empty: # polling period passed without any commands or it is time to check local refs
+                if time.monotonic() < next_poll:
+                    if not self._ref_watcher.changed():
+                        continue
+                    self.metrics.increment("local_ref_changes")
+                    func, args=None, (True,) # rebuild setups list even if nothing changed on the server
+                else:
+                    func, args=None, ()
+            try:
+                if func is None:
+                    self._poll_queued.clear()
+                    next_poll=time.monotonic()+self._scheduler.next_delay()
+                    if self._poll(*args) is False: # deferred, poll again as soon as user commands are done
+                        next_poll=time.monotonic()
+                    elif first_poll:
+                        mark_startup("first poll done")
+                        first_poll=False
+                else:
+                    func(*args)
+            except async_git.CommandCancelled: # stopped by stop(), the thread is finishing
+                pass
             except:
+                self.metrics.increment("failures")
                 err_str=traceback.format_exc()
                 self.err_callback(err_str)
-            self._run_flag.wait(self._timeout) # we can increase this value later
+            if self._ref_watcher is not None:
+                self._ref_watcher.rebaseline() # changes made by this thread do not trigger a refresh
     
-    def _prune_refs(self):
-        # prune the origin repository of stale branches
-        subprocess.run(["git", "remote", "prune", "origin"]) # TODO: use git directly with repo.git, ditch the subprocess use
+    def _put(self, priority, func, *args):
+        # add command to the queue of the git thread
+        self._commands.put((priority, next(self._order), func, args))
     
-    def _get_setups(self):
-        # pull any new branches or changes to existing branches, 
-        # returns a dictionary of all the branches filtered by
-        # ignore_setups list
+    def _setting_changed(self, section, option, value):
+        # settings subscriber, may be called from any thread
+        if ((section == self._settings.section) and (option in ("timeout", "max_timeout"))) or ((section == "webhook") and (option == "fallback_timeout")):
+            self.update_timeout(self._settings.timeout)
+        elif (section == self._settings.section) and (option == "repo_path") and self._settings.repo_path: # ignore paths which do not exist
+            self.update_repo_path(self._settings.repo_path)
+    
+    def _user_command_waiting(self):
+        # check if there is a command with higher priority than poll in the queue
+        with self._commands.mutex:
+            return bool(self._commands.queue) and (self._commands.queue[0][0] < PRIORITY_POLL)
+    
+    def _poll(self, rebuild=False):
+        # check the server for changes and notify the callback, returns 
+        # False if the poll was deferred because a user command is waiting.
+        # With rebuild the list of setups is read again from local refs 
+        # even if nothing changed on the server
+        start=time.perf_counter()
+        self._settings.check_for_changes() # settings.ini may have been edited while running
         try:
-            self._repo.remotes.origin.pull()
-        except git.exc.GitCommandError: # this will be raised when the branch has been deleted
-            self.load_setup("main", None, True) # load main branch temporarely because we know this will never be deleted; we already have a lock and no callback func
-        branches=self._repo.refs # get all available branches form GIT server
-        setups={} # setups will be in dictionary with key being index in refs list and value being the setup name
-        for branch in branches: # convert the ref objects into branch name strings
-            if isinstance(branch, git.RemoteReference) and (str(branch) != "origin/HEAD"): # check if valid branch name (e.g. HEAD not valid)
-                branch_name=str(branch).split("/")[-1] # get only the branch name
-                if branch_name not in ignore_setups: # check if this branch we ignore
-                    setups[branches.index(branch)]=branch_name
-        
-        # if we switched the main then now switch to first available branch not main
-        if self.get_active_setup() == "main" or self.get_active_setup() == "master":
-            self.load_setup(list(setups.values())[0], None, True) # load first existing setup/branch
-        
-        return setups   # there needs to be a check to see if any new branch available
+            wait_start=time.perf_counter()
+            with self._network_slots: # at most max_concurrent_polls repositories talk to the server at once
+                self.metrics.observe("network_wait", time.perf_counter()-wait_start)
+                with self.metrics.timed("ls_remote"):
+                    remote_refs=self._ls_remote()
+                if self._user_command_waiting(): # do not make user wait for fetch and merge
+                    self.metrics.increment("polls_deferred")
+                    return False
+                discovered=self._discover_refs(remote_refs)
+        except async_git.CommandCancelled: # user command queued while talking to the server, the next poll starts over
+            self.metrics.increment("polls_deferred")
+            return False
+        except (git.exc.GitCommandError, TimeoutError): # network blip, server down or mirror locked for too long, try again later
+            self.metrics.increment("polls_offline")
+            self._scheduler.record(False)
+            self._report_status(self.get_active_setup(), STATUS_OFFLINE)
+            self._record_poll(start) # offline polls count in the statistics too
+            return True
+        if discovered or ((self._status is not None) and (self._status[1] != STATUS_OK)): # dirty tree may have been cleaned up
+            self._update_active_setup()
+        filter_changed=self._filter.reload_if_changed() # rules file can be edited while running
+        if (self._sparse is not None) and self._sparse.reload_if_changed():
+            self._update_sparse_checkout()
+        if discovered or filter_changed or rebuild: # only rebuild the list when something changed
+            with self.metrics.timed("get_setups"):
+                new_setups=self._get_setups() # get the list of all branches/setups
+            events=diff_setups(self._setups, new_setups)
+        else:
+            events=[]
+        self._scheduler.record(bool(events))
+        if events:
+            self._setups=new_setups
+            self.metrics.increment("changes_detected", len(events))
+            with self.metrics.timed("callback"):
+                self.callback(events)
+        active_setup=self.get_active_setup()
+        active_changed=(active_setup != self._active_setup)
+        if active_changed: # switched by the poll or changed outside of this application
+            self._active_setup=active_setup
+            if self.loaded_callback is not None:
+                self.loaded_callback(active_setup)
+        if events or active_changed:
+            self._write_cache()
+        self._record_poll(start)
+        return True
+    
+    def _record_poll(self, start):
+        # record duration of a finished poll and export the metrics
+        self.metrics.observe("poll", time.perf_counter()-start)
+        self.metrics.increment("polls")
+        self.metrics.export()
+    
+    def _read_cache(self):
+        # read setups saved by the previous run, returns None if there is no
+        # usable cache for this repository
+        try:
+            with open(self._settings.cache_file) as f:
+                cache=json.load(f)
+        except (OSError, ValueError): # no cache yet or it is corrupted
+            return None
+        if cache.get("repo_path") != self._repo_path:
+            return None
+        return cache
+    
+    def _write_cache(self):
+        # save current setups to disk, written to temporary file first so 
+        # that a crash never leaves a partially written cache behind
+        cache={"repo_path": self._repo_path, "active": self._active_setup, "fetched": time.time(), "setups": self._setups}
+        tmp_file=self._settings.cache_file+".tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(cache, f, separators=(",", ":"))
+        os.replace(tmp_file, self._settings.cache_file)
+    
+    def get_cached_setups(self):
+        """
+        Return setups saved to disk by the previous run
+        
+        Returns
+        -------
+        dict or None
+            dictionary with keys "setups" (branch name to SHA), 
+            "active" (active setup name) and "fetched" (time of 
+            saving as returned by time.time()), None if there is no 
+            cache for this repository
+        """
+        return self._cache
+    
+    def _ls_remote(self):
+        # ask the server only for branch names and SHAs (single lightweight
+        # round trip), returns a dictionary with branch name as a key and
+        # commit SHA as a value. In mirror mode the mirror is created if it
+        # does not exist yet and refreshed if no machine has done it recently
+        if self._mirror is not None:
+            self._mirror.ensure()
+            self._mirror.attach(self._repo)
+            with self.metrics.timed("mirror_refresh"):
+                self._mirror.refresh(self._settings.mirror_max_age)
+        remote_refs={}
+        for line in self._git("ls-remote", "--heads", self._fetch_source(), network=True, cancelled=self._user_command_waiting).stdout.splitlines():
+            sha, ref=line.split("\t")
+            remote_refs[ref[len("refs/heads/"):]]=sha
+        return remote_refs
+    
+    def _discover_refs(self, remote_refs):
+        # compare branches on the server (result of _ls_remote) against the 
+        # last snapshot and fetch only the ones that were added or moved 
+        # and remove tracking refs of deleted branches. Working tree is not
+        # touched, see _update_active_setup(). Returns True if anything 
+        # changed since the last call
+        if remote_refs == self._remote_refs:
+            return False # nothing changed on the server - no fetch and no merge
+        
+        if self._remote_refs is None: # first run, local tracking refs may be arbitrarily stale
+            changed=list(remote_refs)
+            removed=[]
+        else:
+            changed=[name for name, sha in remote_refs.items() if self._remote_refs.get(name) != sha]
+            removed=[name for name in self._remote_refs if name not in remote_refs]
+        
+        with self.metrics.timed("fetch"):
+            if (self._remote_refs is None) or (len(changed) > MAX_FETCH_REFSPECS):
+                self._git("fetch", "--prune", self._fetch_source(), "+refs/heads/*:refs/remotes/origin/*", network=True, 
+                          cancelled=self._user_command_waiting) # one full fetch is cheaper than a huge list of refspecs
+            elif changed:
+                self._git("fetch", self._fetch_source(), *["+refs/heads/{0}:refs/remotes/origin/{0}".format(name) for name in changed], network=True, 
+                          cancelled=self._user_command_waiting)
+        for name in removed:
+            if self._remote_refs is not None: # already pruned by the full fetch on first run
+                self._git("update-ref", "-d", "refs/remotes/origin/"+name, writes=True)
+        self._remote_refs=remote_refs
+        return True
+    
+    def _update_active_setup(self):
+        # fast-forward the active setup to the fetched commit of its branch 
+        # if that is safe and report the state of the active setup. Local 
+        # changes and commits are never overwritten and the setup is never
+        # switched to another one
+        active_setup=self.get_active_setup()
+        if self._remote_refs is None: # server not polled yet, nothing to compare against
+            return
+        remote_sha=self._remote_refs.get(active_setup)
+        if remote_sha is None:
+            self._report_status(active_setup, STATUS_DELETED)
+            return
+        pooled=(self._pool is not None) and (active_setup in self._pool)
+        work_tree=self._pool.path(active_setup) if pooled else self._repo.working_dir
+        try:
+            local_sha=self._git_in(work_tree, "rev-parse", "HEAD")[1]
+            if local_sha == remote_sha:
+                status=STATUS_OK
+            elif self._git_in(work_tree, "status", "--porcelain", "--untracked-files=no")[1]:
+                status=STATUS_DIRTY
+            elif self._git_in(work_tree, "merge-base", "--is-ancestor", local_sha, remote_sha)[0] != 0:
+                status=STATUS_DIVERGED
+            else:
+                status=None # behind the server, fast-forward below
+        except TimeoutError: # e.g. huge working tree on a slow disk, checked again on the next poll
+            self._report_status(active_setup, STATUS_TIMEOUT)
+            return
+        if status is None:
+            try:
+                with self.metrics.timed("merge"):
+                    if pooled:
+                        self._pool.update(active_setup)
+                    else:
+                        self._git("merge", "--ff-only", "origin/"+active_setup, writes=True) # no merge commits, no conflicts
+                status=STATUS_OK
+            except git.exc.GitCommandError: # git left the tree untouched, tried again on the next poll
+                status=STATUS_BLOCKED
+        self._report_status(active_setup, status)
+    
+    def _git(self, *args, network=False, writes=False, unlimited=False, cwd=None, cancelled=None, check=True):
+        # run git command in the repository (or cwd) through the asyncio 
+        # backend and return its GitResult. The command is stopped after the
+        # network or local timeout (not for unlimited commands, e.g. the 
+        # initial mirror clone), when the thread is being stopped or as 
+        # soon as optional cancelled() returns True (raises CommandCancelled).
+        # Commands which write the working tree, index or config (writes) 
+        # are never stopped, a half done checkout would leave lock files 
+        # behind
+        if writes:
+            return self._git_runner.run(["git", *args], cwd=cwd or self._repo.working_dir, check=check)
+        if unlimited:
+            timeout=None
+        else:
+            timeout=self._settings.git_network_timeout if network else self._settings.git_local_timeout
+        stopping=self._run_flag.is_set
+        return self._git_runner.run(["git", *args], cwd=cwd or self._repo.working_dir, timeout=timeout, 
+                                    cancelled=stopping if cancelled is None else (lambda: stopping() or cancelled()), check=check)
+    
+    def _git_in(self, work_tree, *args):
+        # run read-only git command in the working tree, returns exit status 
+        # and output without raising on failure. Optional locks are off, so 
+        # "git status" does not refresh the index and can be stopped safely
+        result=self._git("--no-optional-locks", *args, cwd=work_tree, check=False)
+        return result.status, result.stdout
+    
+    def _report_status(self, setup_name, status):
+        # pass state of the active setup to the status callback when it changes
+        if (setup_name, status) == self._status:
+            return
+        self._status=(setup_name, status)
+        if status != STATUS_OK:
+            self.metrics.increment("status_"+status)
+        if self.status_callback is not None:
+            self.status_callback(setup_name, status)
+    
+    def _get_setups(self):
+        # returns a dictionary of all the remote branches filtered by
+        # setup filter rules, with branch name as a key and SHA as a value
+        setups={}
+        for name, sha in self._ref_index.read().items():
+            if not self._filter.is_ignored(name): # check if this branch we ignore
+                setups[name]=sha
+        return setups
     
     def get_active_setup(self):
         """
@@ -438,12 +1938,19 @@ class GitManager(threading.Thread):
         str
             returns a string of currently checked out branch
         """
+        if self._repo is None: # repository not opened yet, last known setup
+            return self._active_setup
+        if (self._pool is not None) and (self._pool.active is not None):
+            return self._pool.active
         return str(self._repo.head.reference)
     
-    def load_setup(self, setup_name, callback_func=None, lock_aquired=False):
+    def load_setup(self, setup_name, callback_func=None):
         """
         Switch to new branch
         
+        Returns immediately, the switch is queued ahead of any pending
+        poll and done by the git manager thread.
+        
         Parameters
         ----------
         setup_name : str
@@ -451,44 +1958,141 @@ class GitManager(threading.Thread):
         callback_func : function, optional
             reference to the callback function to be called when 
             loading new branch finishes
-        lock_aquired : boolean, optional
-            indicate if the caller already has the lock or not
-        """
-        if lock_aquired is False: 
-            self._lock.acquire()
-        self._prune_refs()
-        branches=self._repo.refs
-        for branch in branches:
-            branch_str=str(branch).split("/")[-1]
-            if branch_str == setup_name:
-                self._repo.git.checkout(branch_str)
-                if callback_func is not None:
-                    callback_func(setup_name) 
-        
-        if lock_aquired is False:
-            self._lock.release()
+        """
+        if self._prefetch_target != setup_name: # prefetch of another setup is useless now
+            self._prefetch_target=None
+        self._put(PRIORITY_USER, self._load_setup, setup_name, callback_func)
+    
+    def prefetch_setup(self, setup_name):
+        """
+        Fetch the branch in background before it is loaded
+        
+        The prefetch runs only when there is no other command in the
+        queue. Only one prefetch is queued at a time and it prefetches 
+        the most recently requested setup, a running prefetch is 
+        cancelled when another setup is requested or loaded. In pool 
+        mode the worktree of the setup is materialized too if the pool
+        has a free slot, so loading it is just a link swap. Worktrees 
+        in the pool are never evicted or checked out by a prefetch.
+        
+        Parameters
+        ----------
+        setup_name : str
+            the name of the branch
+        """
+        self._prefetch_target=setup_name
+        if not self._prefetch_queued.is_set():
+            self._prefetch_queued.set()
+            self._put(PRIORITY_PREFETCH, self._prefetch)
+    
+    def _prefetch(self):
+        # fetch the requested setup, executed in git manager thread
+        self._prefetch_queued.clear()
+        setup_name=self._prefetch_target
+        if (setup_name is None) or (setup_name == self.get_active_setup()):
+            return
+        cancelled=lambda: self._prefetch_target != setup_name
+        with self.metrics.timed("prefetch"):
+            try:
+                self._git("fetch", "-q", self._fetch_source(), "+refs/heads/{0}:refs/remotes/origin/{0}".format(setup_name), network=True, cancelled=cancelled)
+                fetched=True
+            except async_git.CommandCancelled: # another setup was requested or loaded
+                fetched=False
+            except (git.exc.GitCommandError, TimeoutError): # server not reachable or branch deleted, prefetch is only speculative
+                self.metrics.increment("prefetches_failed")
+                return
+            if fetched and (self._pool is not None) and (setup_name not in self._pool) and self._pool.has_free_slot() and not cancelled():
+                self._pool.prepare(setup_name) # only into a free slot, browsing the list must not evict warm worktrees
+        self.metrics.increment("prefetches" if fetched else "prefetches_cancelled")
+    
+    def _load_setup(self, setup_name, callback_func=None):
+        # switch to new branch, executed in git manager thread
+        if setup_name in self._ref_index.read():
+            with self.metrics.timed("load_setup"):
+                if self._pool is not None:
+                    self._pool.activate(setup_name) # pointer swap if the setup is already in the pool
+                else:
+                    self._checkout(setup_name)
+            self.metrics.increment("switches")
+            self._active_setup=setup_name
+            self._update_active_setup() # local branch may be behind the server
+            self._write_cache()
+            if self._prefetch_target == setup_name: # already loaded, nothing to prefetch
+                self._prefetch_target=None
+            if callback_func is not None:
+                callback_func(setup_name) 
+    
+    def _checkout(self, setup_name):
+        # check out the branch, in sparse mode the patterns of the new 
+        # setup are written first so only its folders are written to disk
+        if self._sparse is None:
+            self._git("checkout", setup_name, writes=True)
+            return
+        old_setup=self.get_active_setup()
+        self._sparse.apply(self._repo.git_dir, setup_name)
+        try:
+            self._git("checkout", setup_name, writes=True)
+        except:
+            self._sparse.apply(self._repo.git_dir, old_setup) # checkout failed, keep patterns matching the working tree
+            raise
     
     def update_repo_path(self, path):
-        self._lock.acquire()
+        self._put(PRIORITY_USER, self._update_repo_path, path)
+    
+    def _update_repo_path(self, path):
+        # setups of the old repository are kept, so the next poll reports
+        # them as removed and the callbacks drop them from their lists
         self._repo_path=path
-        os.chdir(self._repo_path) # switch to directory where the repository is located
-        self._repo=git.Repo(self._repo_path)
-        self._setups={}
-        self._lock.release()
+        self._open_repo()
+        self._remote_refs=None
+        self._cache=None
+        self._active_setup=None
+        self.refresh_now() # show setups of the new repository right away
     
     def update_timeout(self, timeout):
-        self._lock.acquire()
-        self._timeout=timeout 
-        self._lock.release()
+        self._put(PRIORITY_USER, self._scheduler.update_period, self._base_period(timeout), self._settings.max_timeout)
+    
+    def refresh_now(self):
+        """
+        Poll the git server immediately instead of waiting for the next period
+        
+        Requests made while a poll is already waiting in the queue are 
+        coalesced into that poll.
+        """
+        self._scheduler.reset() # user is interested in changes, poll often again
+        if not self._poll_queued.is_set():
+            self._poll_queued.set()
+            self._put(PRIORITY_POLL, None)
+    
+    def stop(self):
+        """
+        Stop the git manager thread
+        
+        A running command talking to the server is stopped, a running
+        checkout or merge is finished first.
+        """
+        self._run_flag.set()
+        self._prefetch_target=None # cancels a running prefetch
+        if self._webhook is not None:
+            self._webhook.shutdown()
+            self._webhook.server_close()
+        self._put(PRIORITY_STOP, self._run_flag.set) # wake up the thread if it is waiting for commands
       
-    def start_updating(self, callback, err_callback):
+    def start_updating(self, callback, err_callback, loaded_callback=None, status_callback=None):
         """
         Setup callback functions and start git manager thread
         
         Caller must provide two callback functions. First callback 
         function will be called when the list of branches in git 
         server has changed. The second callback will be called when 
-        there is an exception raised while executing the threading loop
+        there is an exception raised while executing the threading loop.
+        Optional third callback is called when the active setup changes
+        without load_setup being called (e.g. it differs from the cached
+        one). Optional fourth callback is called with setup name and one 
+        of the STATUS_* values when the active setup can not be updated
+        to the latest commit on the server (dirty working tree, diverged
+        branch, branch deleted from the server, server not reachable) 
+        or is up to date again.
         
         Parameters
         ----------
@@ -496,38 +2100,263 @@ class GitManager(threading.Thread):
             called when branches list changes
         err_callback : function
             called when exception is raised while executing
+        loaded_callback : function, optional
+            called with setup name when active setup changes
+        status_callback : function, optional
+            called with setup name and status when state of the active
+            setup changes
         """
         self.callback=callback
         self.err_callback=err_callback
+        self.loaded_callback=loaded_callback
+        self.status_callback=status_callback
         self.start()
+
+class RepoHub():
+    """
+    Git managers of all repositories of the station
+    
+    The main repository is configured in [main] section of settings.ini
+    and additional ones in [repo:<name>] sections (read at start up, 
+    repositories whose path does not exist on this machine are skipped).
+    Every repository has its own git manager thread polling on its own
+    schedule, so a slow server of one repository does not delay the
+    others. At most max_concurrent_polls of them list and fetch 
+    branches at the same time.
+    
+    Attributes
+    ----------
+    managers : OrderedDict
+        repository name -> GitManager, MAIN_REPO first
+    
+    Methods
+    -------
+    refresh_now()
+        Poll the git server of every repository immediately
+    stop()
+        Stop git managers of all repositories
+    """
+    def __init__(self, run_flag, settings_ref):
+        """
+        Parameters
+        ----------
+        run_flag : threading.Event
+            event flag to signal when user has closed GUI
+        settings_ref : SettingsHandler
+            settings of the application
+        """
+        self._network_slots=threading.BoundedSemaphore(settings_ref.max_concurrent_polls)
+        self.managers=OrderedDict()
+        self.managers[MAIN_REPO]=GitManager(run_flag, settings_ref, self._network_slots)
+        for name in settings_ref.repo_names():
+            repo_settings=RepoSettings(settings_ref, name)
+            if repo_settings.repo_path: # not cloned on this machine
+                self.managers[name]=GitManager(run_flag, repo_settings, self._network_slots)
+    
+    def refresh_now(self):
+        """
+        Poll the git server of every repository immediately
+        """
+        for git_man in self.managers.values():
+            git_man.refresh_now()
+    
+    def stop(self):
+        """
+        Stop git managers of all repositories
+        """
+        for git_man in self.managers.values():
+            git_man.stop()
         
-def is_running(): # this function checks if there is an MCP manager app running already
+class InstanceServer(threading.Thread):
+    """
+    Receive commands from other launches of the application
+    
+    Listens on the socket held by the running instance (see 
+    acquire_instance_lock) for single line commands in form 
+    "<command> <argument>" and replies with a single line "ok" or 
+    "error <reason>". Commands are passed to the handler without 
+    waiting for them to finish, so the sending process can exit 
+    immediately.
+    """
+    def __init__(self, lock_socket, handler):
+        """
+        Parameters
+        ----------
+        lock_socket : socket.socket
+            bound socket returned by acquire_instance_lock
+        handler : function
+            called with command and argument strings, must be thread 
+            safe, raises KeyError for an unknown setup
+        """
+        threading.Thread.__init__(self, daemon=True) # do not keep application running after GUI is closed
+        self._socket=lock_socket
+        self._handler=handler
+    
+    def run(self):
+        # internal function for threading - accept connections until the socket is closed
+        while True:
+            try:
+                conn, address=self._socket.accept()
+            except OSError: # socket closed
+                return
+            with conn:
+                try:
+                    conn.settimeout(2) # never let a misbehaving client block other launches
+                    command, _, argument=conn.makefile('r').readline().strip().partition(" ")
+                    if command in (IPC_LOAD, IPC_REFRESH, IPC_SHOW):
+                        try:
+                            self._handler(command, argument)
+                            reply="ok"
+                        except KeyError:
+                            reply="error unknown setup "+argument
+                    else:
+                        reply="error unknown command "+command
+                    conn.sendall((reply+"\n").encode())
+                    while conn.recv(1024): # let the client close first, TIME_WAIT then stays on its ephemeral port, not on the lock port
+                        pass
+                except OSError: # client went away or timed out
+                    continue
+
+def send_instance_command(command, argument="", port=INSTANCE_PORT):
     """
-    Check if MCP manager instance ia already running
+    Forward a command to the running instance of the application
+    
+    Parameters
+    ----------
+    command : str
+        one of IPC_LOAD, IPC_REFRESH or IPC_SHOW
+    argument : str, optional
+        setup name for IPC_LOAD
+    port : int, optional
+        local port held by the running instance
     
     Returns
     -------
-    boolean
-        True is running, False if not
+    str
+        reply of the running instance ("ok" or "error <reason>")
     """
-    output = subprocess.check_output(('TASKLIST', '/FI', 'WINDOWTITLE eq MCP manager'))
-    if re.search("Console", str(output)):
-        return True
-    else:
-        return False
+    with socket.create_connection(("127.0.0.1", port), timeout=2) as conn:
+        conn.sendall((command+" "+argument+"\n").encode())
+        return conn.makefile('r').readline().strip()
+
+def run_headless(settings, instance_lock):
+    """
+    Run git manager without GUI and serve the local JSON API
+    
+    Blocks until interrupted (Ctrl+C). Commands forwarded from other 
+    launches (--load, --refresh) are executed as well.
+    
+    Parameters
+    ----------
+    settings : SettingsHandler
+        settings of the application
+    instance_lock : socket.socket
+        socket returned by acquire_instance_lock
+    """
+    import mcp_api # HTTP server is only needed in headless mode, keep it out of GUI start up
+    
+    def handle_remote_command(command, argument):
+        if command == IPC_LOAD:
+            state.load(argument) # KeyError for an unknown setup is replied to the sending launch
+        elif command == IPC_REFRESH:
+            state.refresh()
+    
+    git_man=GitManager(threading.Event(), settings)
+    state=mcp_api.SetupState(git_man)
+    server=mcp_api.ApiServer(settings.api_port, state)
+    InstanceServer(instance_lock, handle_remote_command).start()
+    git_man.start_updating(state.update_setups_list, state.error_print, state.setup_loaded, state.setup_status)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        git_man.stop()
+        settings.flush()
+
+def acquire_instance_lock(port=INSTANCE_PORT):
+    """
+    Make sure that only one MCP manager instance is running
+    
+    Binds a local TCP port which stays bound for the lifetime of the
+    returned socket, the operating system releases it when the 
+    process exits (even if it crashes). The socket is also used by
+    InstanceServer to receive commands from other launches.
+    
+    Parameters
+    ----------
+    port : int, optional
+        local port used as the lock
+    
+    Returns
+    -------
+    socket.socket or None
+        bound socket that must be kept open while the application is 
+        running, None if another instance is already running
+    """
+    lock_socket=socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if os.name == "nt": # without this Windows lets another process bind the same port
+        lock_socket.setsockopt(socket.SOL_SOCKET, socket.SO_EXCLUSIVEADDRUSE, 1)
+    else: # connections left in TIME_WAIT must not block a relaunch, a listening socket still can not be bound twice
+        lock_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        lock_socket.bind(("127.0.0.1", port))
+    except OSError: # port already taken by running instance
+        lock_socket.close()
+        return None
+    lock_socket.listen(5) # other launches can connect (and wait) even before InstanceServer is started
+    return lock_socket
 
 if __name__ == "__main__":
+    settings=None # flushed on any exit, setters only schedule the write
     try:
-        if is_running(): # if already running then don't open another app
-            info_win=tk.Tk()
-            info_win.withdraw()
-            messagebox.showinfo(title=None,message="MCP manager already running!")
+        parser=argparse.ArgumentParser(description="MCP manager")
+        parser.add_argument("--startup-timing", action="store_true", help="append start up timing marks to startup_timing.log")
+        parser.add_argument("--load", metavar="SETUP", help="load the setup in the running instance")
+        parser.add_argument("--refresh", action="store_true", help="make the running instance poll the Git server now")
+        parser.add_argument("--headless", action="store_true", help="run without GUI and serve the local JSON API")
+        parser.add_argument("--campaign", metavar="PATTERN", nargs="+", help="run --command for every setup matching the names or patterns and exit")
+        parser.add_argument("--command", help="shell command run in the worktree of every setup of the campaign")
+        parser.add_argument("--jobs", type=int, help="number of campaign commands run in parallel (default: number of CPUs)")
+        parser.add_argument("--job-timeout", type=float, help="seconds after which a campaign command is killed")
+        parser.add_argument("--output", help="write JSON summary of the campaign to this file")
+        args=parser.parse_args()
+        mark_startup("imports done")
+        if args.campaign: # batch mode, runs next to the GUI or daemon if one is running
+            if not args.command:
+                parser.error("--campaign requires --command")
+            import campaign
+            sys.exit(campaign.run_campaign(SettingsHandler(), args.campaign, args.command, args.jobs, args.job_timeout, args.output))
+        instance_lock=acquire_instance_lock() # held until the process exits
+        if instance_lock is None: # if already running then forward the command and don't open another app
+            try:
+                if args.load:
+                    print(send_instance_command(IPC_LOAD, args.load))
+                elif args.refresh:
+                    print(send_instance_command(IPC_REFRESH))
+                else:
+                    send_instance_command(IPC_SHOW) # bring the running window to front
+            except OSError: # instance is starting up or not responding
+                info_win=tk.Tk()
+                info_win.withdraw()
+                messagebox.showinfo(title=None,message="MCP manager already running!")
+        elif args.headless:
+            settings=SettingsHandler()
+            if not settings.repo_path: # nobody to ask for the path in headless mode
+                print("Repository path in settings.ini does not exist", file=sys.stderr)
+                sys.exit(1)
+            run_headless(settings, instance_lock)
         else: 
             settings=SettingsHandler()
-            input_win=tk.Tk() # root object in case we need to create input or error windows
-            input_win.withdraw() # make it invisible
-            input_win.iconbitmap(default=os.path.join(sys.path[0],"icons/mcp_icon.ico")) # all windows have the same MCP icon
+            input_win=None # root object in case we need to create input or error windows, created only when needed
             for setting, value in settings: # retrieve all settings and check they are valid
+                if value or (setting == "timeout"): # valid setting, nothing to ask
+                    continue
+                if input_win is None:
+                    input_win=tk.Tk()
+                    input_win.withdraw() # make it invisible
+                    input_win.iconbitmap(default=os.path.join(sys.path[0],"icons/mcp_icon.ico")) # all windows have the same MCP icon
                 while True:
                     try:
                         if (not value) and (setting == "repo_path"): # if setting value is unset then its an empty string
@@ -539,23 +2368,33 @@ if __name__ == "__main__":
 
                         if value is None: # user pressed X or Cancelled
                             input_win.destroy()  
+                            settings.flush() # keep the paths entered so far
                             sys.exit()
                         setattr(settings, setting, value) # save the user provided input to settings file
                     except ValueError: # input invalid, continue asking until user specifies correct input
                         messagebox.showerror(title=None,message="Specified path is not valid!")
+                        value=''
                         continue
                     
                     break # if input valid then break 
-            input_win.destroy() # we will use MCP root window later if any messageboxes need to be created
-            del input_win
+            if input_win is not None:
+                input_win.destroy() # we will use MCP root window later if any messageboxes need to be created
+                del input_win
+            mark_startup("settings read")
                           
             run=threading.Event()
-            git_man=GitManager(run, settings)
-            git_gui=GitGui(git_man, run, settings)
+            hub=RepoHub(run, settings)
+            git_gui=GitGui(hub, run, settings)
+            InstanceServer(instance_lock, git_gui.handle_remote_command).start()
+            mark_startup("window created")
+            git_gui.after_idle(mark_startup, "window shown")
             git_gui.mainloop() 
+            if args.startup_timing:
+                write_startup_timing(os.path.join(sys.path[0], "startup_timing.log"))
     except SystemExit:
         pass # just close application
     except:
         traceback.print_exc()
+        if settings is not None:
+            settings.flush()
         input("PRESS ENTER TO CLOSE")
-        
\ No newline at end of file
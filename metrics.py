@@ -0,0 +1,190 @@
+import os, json, time, threading, socket
+
+from contextlib import contextmanager
+
+LATENCY_BUCKETS=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf")) # upper bounds in seconds
+FORMAT_JSONL="jsonl"
+FORMAT_PROMETHEUS="prometheus"
+
+class Metrics():
+    """
+    Latency histograms and counters of git manager operations
+    
+    Every timed operation is counted into cumulative histogram buckets
+    (LATENCY_BUCKETS) together with its total time and the duration
+    and time of its last run. Counters count events such as polls,
+    detected changes, switches and failures. Collected data can be
+    exported to a rotating JSON-lines log or a Prometheus textfile
+    (for node_exporter textfile collector). All methods are thread
+    safe.
+    
+    Methods
+    -------
+    timed(operation)
+        Context manager measuring duration of the enclosed block
+    observe(operation, seconds)
+        Record duration of an operation
+    increment(counter, value=1)
+        Increase a counter
+    last(operation)
+        Return duration and time of the last run of an operation
+    export()
+        Write collected data to the configured file
+    """
+    def __init__(self, export_format="", export_path="", max_bytes=1000000, backups=3):
+        """
+        Parameters
+        ----------
+        export_format : str, optional
+            FORMAT_JSONL, FORMAT_PROMETHEUS or empty string to disable
+            exporting
+        export_path : str, optional
+            file to export to
+        max_bytes : int, optional
+            size of JSON-lines log after which it is rotated
+        backups : int, optional
+            number of rotated JSON-lines logs kept
+        """
+        self._export_format=export_format
+        self._export_path=export_path
+        self._max_bytes=max_bytes
+        self._backups=backups
+        self._lock=threading.Lock()
+        self._histograms={} # operation -> {"buckets": [...], "sum": float, "count": int}
+        self._last={} # operation -> (seconds, time.time() of the end)
+        self._counters={}
+    
+    @contextmanager
+    def timed(self, operation):
+        """
+        Context manager measuring duration of the enclosed block
+        
+        Duration is recorded also when the block raises an exception.
+        
+        Parameters
+        ----------
+        operation : str
+            name of the operation
+        """
+        start=time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(operation, time.perf_counter()-start)
+    
+    def observe(self, operation, seconds):
+        """
+        Record duration of an operation
+        
+        Parameters
+        ----------
+        operation : str
+            name of the operation
+        seconds : float
+            duration of the operation
+        """
+        with self._lock:
+            histogram=self._histograms.get(operation)
+            if histogram is None:
+                histogram=self._histograms[operation]={"buckets": [0]*len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][index]+=1
+            histogram["sum"]+=seconds
+            histogram["count"]+=1
+            self._last[operation]=(seconds, time.time())
+    
+    def increment(self, counter, value=1):
+        """
+        Increase a counter
+        
+        Parameters
+        ----------
+        counter : str
+            name of the counter
+        value : int, optional
+            amount to add
+        """
+        with self._lock:
+            self._counters[counter]=self._counters.get(counter, 0)+value
+    
+    def last(self, operation):
+        """
+        Return duration and time of the last run of an operation
+        
+        Parameters
+        ----------
+        operation : str
+            name of the operation
+        
+        Returns
+        -------
+        tuple or None
+            duration in seconds and end time as returned by time.time(),
+            None if the operation has not run yet
+        """
+        with self._lock:
+            return self._last.get(operation)
+    
+    def snapshot(self):
+        """
+        Return copy of collected data
+        
+        Returns
+        -------
+        dict
+            dictionary with keys "histograms", "counters" and "last"
+        """
+        with self._lock:
+            return {"histograms": {operation: {"buckets": list(histogram["buckets"]), "sum": histogram["sum"], "count": histogram["count"]}
+                                   for operation, histogram in self._histograms.items()},
+                    "counters": dict(self._counters),
+                    "last": dict(self._last)}
+    
+    def export(self):
+        """
+        Write collected data to the configured file
+        
+        Does nothing if exporting is disabled.
+        """
+        if self._export_format == FORMAT_JSONL:
+            self._export_jsonl()
+        elif self._export_format == FORMAT_PROMETHEUS:
+            self._export_prometheus()
+    
+    def _export_jsonl(self):
+        # append snapshot as one line, rotate the log when it gets too big
+        snapshot=self.snapshot()
+        line=json.dumps({"time": time.time(), "host": socket.gethostname(), "counters": snapshot["counters"],
+                         "histograms": snapshot["histograms"], "last": {operation: seconds for operation, (seconds, end) in snapshot["last"].items()}},
+                        separators=(",", ":"))
+        try:
+            if os.path.getsize(self._export_path) > self._max_bytes:
+                for index in range(self._backups-1, 0, -1):
+                    if os.path.exists("{}.{}".format(self._export_path, index)):
+                        os.replace("{}.{}".format(self._export_path, index), "{}.{}".format(self._export_path, index+1))
+                os.replace(self._export_path, self._export_path+".1")
+        except FileNotFoundError: # first export
+            pass
+        with open(self._export_path, 'a') as f:
+            f.write(line+"\n")
+    
+    def _export_prometheus(self):
+        # rewrite the textfile atomically, collector must never see a partial file
+        snapshot=self.snapshot()
+        lines=["# TYPE mcp_manager_operation_seconds histogram"]
+        for operation, histogram in sorted(snapshot["histograms"].items()):
+            for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                lines.append('mcp_manager_operation_seconds_bucket{{operation="{}",le="{}"}} {}'.format(operation, "+Inf" if bound == float("inf") else bound, count))
+            lines.append('mcp_manager_operation_seconds_sum{{operation="{}"}} {}'.format(operation, histogram["sum"]))
+            lines.append('mcp_manager_operation_seconds_count{{operation="{}"}} {}'.format(operation, histogram["count"]))
+        lines.append("# TYPE mcp_manager_events_total counter")
+        for counter, value in sorted(snapshot["counters"].items()):
+            lines.append('mcp_manager_events_total{{event="{}"}} {}'.format(counter, value))
+        lines.append("# TYPE mcp_manager_last_run_timestamp_seconds gauge")
+        for operation, (seconds, end) in sorted(snapshot["last"].items()):
+            lines.append('mcp_manager_last_run_timestamp_seconds{{operation="{}"}} {}'.format(operation, end))
+        tmp_file=self._export_path+".tmp"
+        with open(tmp_file, 'w') as f:
+            f.write("\n".join(lines)+"\n")
+        os.replace(tmp_file, self._export_path)
@@ -0,0 +1,190 @@
+import os, time, shutil, socket
+
+LOCK_WAIT=600 # seconds to wait for another machine to finish refreshing the mirror
+LOCK_STALE=1800 # seconds after which a lock left behind by a crashed machine is removed
+STAMP_FILE="mcp_mirror_fetched" # touched after every refresh, its modification time tells how fresh the mirror is
+
+class MirrorLock():
+    """
+    Lock file next to the mirror shared by all machines
+    
+    Created with exclusive create, which also works on network shares.
+    Use as a context manager.
+    """
+    def __init__(self, path, wait=LOCK_WAIT):
+        """
+        Parameters
+        ----------
+        path : str
+            path of the lock file
+        wait : float, optional
+            maximum seconds to wait for the lock
+        """
+        self._path=path
+        self._wait=wait
+    
+    def __enter__(self):
+        deadline=time.monotonic()+self._wait
+        while True:
+            try:
+                fd=os.open(self._path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    if time.time()-os.stat(self._path).st_mtime > LOCK_STALE: # owner crashed while refreshing
+                        os.remove(self._path)
+                        continue
+                except FileNotFoundError: # released in the meantime
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError("mirror is locked by another machine: "+self._path)
+                time.sleep(0.2)
+                continue
+            os.write(fd, "{} {}\n".format(socket.gethostname(), os.getpid()).encode())
+            os.close(fd)
+            return self
+    
+    def __exit__(self, *args):
+        os.remove(self._path)
+
+
+class SharedMirror():
+    """
+    Bare mirror of the git server shared by several machines
+    
+    The mirror lives on the same host or a shared disk. Only one of the
+    machines using it fetches from the git server at a time and not
+    more often than once per max_age seconds, the others read branches
+    from the mirror and fetch from it. Repositories using the mirror
+    borrow its objects through objects/info/alternates, so fetching
+    from the mirror copies almost nothing.
+    
+    Methods
+    -------
+    ensure()
+        Create the mirror if it does not exist yet
+    age()
+        Return seconds since the last refresh of the mirror
+    refresh(max_age)
+        Fetch from the git server unless the mirror is fresh enough
+    attach(repo)
+        Let the repository use objects of the mirror
+    """
+    def __init__(self, run_git, path, upstream_url, run_clone=None):
+        """
+        Parameters
+        ----------
+        run_git : function
+            called with git arguments to run a command talking to the
+            git server, raises an exception if the command fails
+        path : str
+            path of the bare mirror
+        upstream_url : str
+            URL of the git server
+        run_clone : function, optional
+            same as run_git for the initial clone of the mirror, which
+            can take much longer than other commands, run_git is used 
+            by default
+        """
+        self._run_git=run_git
+        self._run_clone=run_git if run_clone is None else run_clone
+        self.path=path
+        self._upstream_url=upstream_url
+        self._lock_path=path+".lock" # next to the mirror, it must exist before the mirror is cloned
+        self._stamp_path=os.path.join(path, STAMP_FILE)
+    
+    def _git(self, *args):
+        return self._run_git("--git-dir", self.path, *args)
+    
+    def ensure(self):
+        """
+        Create the mirror if it does not exist yet
+        
+        The mirror is cloned into a temporary folder next to it and moved
+        into place when complete, so other machines never use a mirror
+        which is still being cloned. The stamp file marks a complete
+        mirror.
+        
+        Raises
+        ------
+        FileExistsError
+            path exists but is not a mirror created by this class, it 
+            is never deleted
+        """
+        if os.path.exists(self._stamp_path):
+            return
+        with MirrorLock(self._lock_path):
+            if os.path.exists(self._stamp_path): # created by another machine while waiting for the lock
+                return
+            if os.path.exists(self.path): # mirrors are only moved into place complete, this is something else
+                raise FileExistsError("mirror path exists but is not a mirror created by this application: "+self.path)
+            temp_path=self.path+".tmp"
+            if os.path.exists(temp_path): # clone interrupted by a crash or a timeout
+                shutil.rmtree(temp_path)
+            self._run_clone("clone", "--mirror", "--quiet", self._upstream_url, temp_path)
+            self._run_git("--git-dir", temp_path, "config", "gc.pruneExpire", "never") # objects may still be used by machines borrowing them
+            with open(os.path.join(temp_path, STAMP_FILE), 'w'):
+                pass
+            os.replace(temp_path, self.path)
+    
+    def age(self):
+        """
+        Return seconds since the last refresh of the mirror
+        
+        Returns
+        -------
+        float
+            age of the mirror, infinity if it was never refreshed
+        """
+        try:
+            return time.time()-os.stat(self._stamp_path).st_mtime
+        except FileNotFoundError:
+            return float("inf")
+    
+    def refresh(self, max_age):
+        """
+        Fetch from the git server unless the mirror is fresh enough
+        
+        Parameters
+        ----------
+        max_age : float
+            seconds a refresh made by any machine is reused
+        
+        Returns
+        -------
+        boolean
+            True if this call fetched from the git server
+        """
+        if self.age() < max_age:
+            return False
+        with MirrorLock(self._lock_path):
+            if self.age() < max_age: # refreshed by another machine while waiting for the lock
+                return False
+            self._git("fetch", "--prune", "--quiet", "origin")
+            self._touch()
+        return True
+    
+    def _touch(self):
+        with open(self._stamp_path, 'w'):
+            pass
+    
+    def attach(self, repo):
+        """
+        Let the repository use objects of the mirror
+        
+        Parameters
+        ----------
+        repo : git.Repo
+            repository which borrows objects from the mirror
+        """
+        mirror_objects=os.path.abspath(os.path.join(self.path, "objects"))
+        alternates_file=os.path.join(repo.common_dir, "objects", "info", "alternates")
+        try:
+            with open(alternates_file) as f:
+                alternates=f.read().splitlines()
+        except FileNotFoundError:
+            alternates=[]
+        if mirror_objects in alternates:
+            return
+        os.makedirs(os.path.dirname(alternates_file), exist_ok=True)
+        with open(alternates_file, 'a') as f:
+            f.write(mirror_objects+"\n")
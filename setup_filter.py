@@ -0,0 +1,113 @@
+import os, re, fnmatch
+
+class SetupFilter():
+    """
+    Decide which setups (branches) are hidden from the user
+    
+    Rules are read from a text file with one rule per line: exact
+    setup name, "glob:<pattern>" or "re:<pattern>" to ignore matching
+    setups and "only:<pattern>" to show only setups matching one of
+    such patterns. Lines starting with # are comments. Exact names are
+    kept in a set and all patterns of a kind are compiled into a
+    single regular expression. The file is read again when its
+    modification time changes.
+    
+    Methods
+    -------
+    reload_if_changed()
+        Read the rules again if the file has changed
+    is_ignored(setup_name)
+        Check if the setup should be hidden
+    """
+    def __init__(self, file_path):
+        """
+        Parameters
+        ----------
+        file_path : str
+            path to the file with the rules, missing file means no rules
+        """
+        self._file_path=file_path
+        self._mtime=None
+        self._exact=frozenset()
+        self._ignore_re=None
+        self._only_re=None
+        self._results={} # setup name -> is ignored, cleared when rules change
+        self.errors=[] # invalid rules skipped while reading the file
+    
+    def reload_if_changed(self):
+        """
+        Read the rules again if the file has changed
+        
+        Returns
+        -------
+        boolean
+            True if the rules were (re)loaded
+        """
+        try:
+            mtime=os.stat(self._file_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime=0 # no file, no rules
+        if mtime == self._mtime:
+            return False
+        self._mtime=mtime
+        self._load()
+        return True
+    
+    def _load(self):
+        # parse the rules file and compile the patterns
+        exact=set()
+        ignore_patterns=[]
+        only_patterns=[]
+        self.errors=[]
+        lines=[]
+        if self._mtime:
+            with open(self._file_path) as f:
+                lines=f.read().splitlines()
+        for line_number, line in enumerate(lines, 1):
+            rule=line.strip()
+            if not rule or rule.startswith("#"):
+                continue
+            try:
+                if rule.startswith("glob:"):
+                    ignore_patterns.append(fnmatch.translate(rule[len("glob:"):]))
+                elif rule.startswith("re:"):
+                    ignore_patterns.append(re.compile(rule[len("re:"):]).pattern) # compile to find errors early
+                elif rule.startswith("only:"):
+                    only_patterns.append(fnmatch.translate(rule[len("only:"):]))
+                else:
+                    exact.add(rule)
+            except re.error as err: # skip the invalid rule, the rest of the file still applies
+                self.errors.append("line {}: {}".format(line_number, err))
+        self._exact=frozenset(exact)
+        self._ignore_re=self._combine(ignore_patterns)
+        self._only_re=self._combine(only_patterns)
+        self._results={}
+    
+    def _combine(self, patterns):
+        # compile list of patterns into one alternation, None if there are no patterns
+        if not patterns:
+            return None
+        return re.compile("|".join("(?:{})".format(pattern) for pattern in patterns))
+    
+    def is_ignored(self, setup_name):
+        """
+        Check if the setup should be hidden
+        
+        Parameters
+        ----------
+        setup_name : str
+            name of the setup (branch)
+        
+        Returns
+        -------
+        boolean
+            True if the setup is ignored
+        """
+        if setup_name in self._exact:
+            return True
+        result=self._results.get(setup_name)
+        if result is None:
+            result=((self._only_re is not None) and (self._only_re.fullmatch(setup_name) is None)) or \
+                ((self._ignore_re is not None) and (self._ignore_re.fullmatch(setup_name) is not None))
+            self._results[setup_name]=result
+        return result
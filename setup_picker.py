@@ -0,0 +1,283 @@
+import bisect
+import tkinter as tk
+import tkinter.ttk as ttk
+
+SEARCH_DELAY=150 # milliseconds after the last key press before the list is filtered
+OTHER_GROUP="" # group of setups without a product prefix
+GROUP_ROWS=200 # rows shown per group at first and added by each "more..." row
+
+def setup_group(setup_name):
+    """
+    Return product prefix of the setup used to group setups
+    
+    Parameters
+    ----------
+    setup_name : str
+        name of the setup (branch), e.g. AIR1281_setup_1
+    
+    Returns
+    -------
+    str
+        text before the first underscore (e.g. AIR1281), OTHER_GROUP if
+        the name has no underscore
+    """
+    prefix, separator, rest=setup_name.partition("_")
+    return prefix if separator else OTHER_GROUP
+
+class SetupPicker(tk.Frame):
+    """
+    Searchable list of setups grouped by product prefix
+    
+    Setups are shown in a tree with one collapsible node per product
+    prefix and filtered by the text typed into the search field. Rows
+    are created only when their group is opened or they match the
+    search, and at most GROUP_ROWS more at a time per group (a "more..."
+    row shows the next ones), so the number of widgets does not grow 
+    with the number of branches. Changes of setups are applied one by one, the list is
+    never rebuilt, and filtering reorders each group with a single
+    call.
+    
+    Methods
+    -------
+    apply_events(events)
+        Add and remove setups according to SetupEvent tuples
+    reveal(setup_name)
+        Open the group of the setup and select it
+    set_enabled(enabled)
+        Enable or disable selecting setups
+    """
+    def __init__(self, master, on_select, on_activate, width=215, height=190):
+        """
+        Parameters
+        ----------
+        master : tkinter widget
+            parent widget
+        on_select : function
+            called with setup name when user selects a setup
+        on_activate : function
+            called with setup name when user double clicks a setup or
+            presses Enter
+        width : int, optional
+            width of the widget in pixels
+        height : int, optional
+            height of the widget in pixels
+        """
+        tk.Frame.__init__(self, master=master, width=width, height=height)
+        self._on_select=on_select
+        self._on_activate=on_activate
+        self._groups={} # group -> sorted list of setup names
+        self._rows=set() # setups which have a row in the tree
+        self._open_groups=set() # groups opened by the user or by a search
+        self._row_limits={} # group -> number of rows shown, GROUP_ROWS if not expanded with "more..."
+        self._filter_text=""
+        self._search_job=None
+        self._enabled=True
+        
+        self._var_search=tk.StringVar(master=self)
+        self._var_search.trace_add("write", self._search_changed)
+        self._entry_search=tk.Entry(master=self, textvariable=self._var_search)
+        self._entry_search.place(x=0, y=0, width=width)
+        self._entry_search.bind("<Return>", self._search_return)
+        self._entry_search.bind("<Down>", lambda event: self._tree.focus_set())
+        self._tree=ttk.Treeview(master=self, show="tree", selectmode="browse")
+        self._tree.column("#0", width=width-20)
+        self._tree.place(x=0, y=25, width=width-17, height=height-25)
+        self._scrollbar=ttk.Scrollbar(master=self, orient="vertical", command=self._tree.yview)
+        self._scrollbar.place(x=width-17, y=25, width=17, height=height-25)
+        self._tree.configure(yscrollcommand=self._scrollbar.set)
+        self._tree.bind("<<TreeviewOpen>>", self._group_opened)
+        self._tree.bind("<<TreeviewClose>>", self._group_closed)
+        self._tree.bind("<<TreeviewSelect>>", self._selected)
+        self._tree.bind("<Double-1>", self._activated)
+        self._tree.bind("<Return>", self._activated)
+    
+    def _group_iid(self, group):
+        return "group:"+group
+    
+    def _placeholder_iid(self, group):
+        # empty row which makes a group openable before its rows are created
+        return "placeholder:"+group
+    
+    def _more_iid(self, group):
+        # last row of a group with more matching setups than rows shown
+        return "more:"+group
+    
+    def _matches(self, setup_name):
+        return self._filter_text in setup_name.lower()
+    
+    def apply_events(self, events):
+        """
+        Add and remove setups according to SetupEvent tuples
+        
+        Parameters
+        ----------
+        events : list
+            SetupEvent tuples, updated setups do not change the list
+        """
+        touched=set()
+        for event in events:
+            group=setup_group(event.name)
+            names=self._groups.get(group)
+            if event.kind == "removed":
+                if names is None:
+                    continue
+                index=bisect.bisect_left(names, event.name)
+                if (index < len(names)) and (names[index] == event.name):
+                    del names[index]
+                    touched.add(group)
+                if event.name in self._rows:
+                    self._rows.discard(event.name)
+                    self._tree.delete(event.name)
+            else:
+                if names is None:
+                    names=self._groups[group]=[]
+                    self._tree.insert("", "end", iid=self._group_iid(group), text=group or "other")
+                    self._tree.insert(self._group_iid(group), "end", iid=self._placeholder_iid(group))
+                index=bisect.bisect_left(names, event.name)
+                if (index == len(names)) or (names[index] != event.name):
+                    names.insert(index, event.name)
+                    touched.add(group)
+        for group in touched:
+            if not self._groups[group]: # last setup of the group was removed
+                del self._groups[group]
+                self._open_groups.discard(group)
+                self._row_limits.pop(group, None)
+                self._tree.delete(self._group_iid(group))
+            else:
+                self._show_group(group)
+        if touched:
+            self._show_groups()
+    
+    def _show_group(self, group):
+        # update label and rows of the group, rows are only created for
+        # open groups, up to the row limit of the group, and reordered 
+        # with a single call
+        names=self._groups[group]
+        visible=[name for name in names if self._matches(name)] if self._filter_text else names
+        label=group or "other"
+        self._tree.item(self._group_iid(group), text="{} ({})".format(label, len(visible)))
+        if group not in self._open_groups:
+            if self._tree.get_children(self._group_iid(group)) != (self._placeholder_iid(group),):
+                self._tree.set_children(self._group_iid(group), self._placeholder_iid(group))
+            return
+        limit=self._row_limits.get(group, GROUP_ROWS)
+        shown=visible[:limit]
+        for name in shown:
+            if name not in self._rows:
+                self._rows.add(name)
+                self._tree.insert(self._group_iid(group), "end", iid=name, text=name)
+        if len(visible) > limit:
+            if not self._tree.exists(self._more_iid(group)):
+                self._tree.insert(self._group_iid(group), "end", iid=self._more_iid(group))
+            self._tree.item(self._more_iid(group), text="more... ({})".format(len(visible)-limit))
+            shown=shown+[self._more_iid(group)]
+        self._tree.set_children(self._group_iid(group), *shown)
+    
+    def _show_groups(self):
+        # show groups in alphabetical order with "other" last, hide groups without a matching setup
+        groups=sorted(self._groups, key=lambda group: (group == OTHER_GROUP, group))
+        if self._filter_text:
+            groups=[group for group in groups if any(self._matches(name) for name in self._groups[group])]
+        self._tree.set_children("", *[self._group_iid(group) for group in groups])
+    
+    def _search_changed(self, *args):
+        # filter once the user stops typing
+        if self._search_job is not None:
+            self.after_cancel(self._search_job)
+        self._search_job=self.after(SEARCH_DELAY, self._apply_search)
+    
+    def _apply_search(self):
+        # show only setups containing the search text, groups with a match are opened
+        self._search_job=None
+        self._filter_text=self._var_search.get().strip().lower()
+        if self._filter_text:
+            self._open_groups=set(group for group, names in self._groups.items() if any(self._matches(name) for name in names))
+        else:
+            self._open_groups=set()
+        self._row_limits={}
+        for group in self._groups:
+            self._show_group(group)
+            self._tree.item(self._group_iid(group), open=(group in self._open_groups))
+        self._show_groups()
+    
+    def _search_return(self, event=None):
+        # Enter in the search field selects the first matching setup
+        for group in sorted(self._groups, key=lambda group: (group == OTHER_GROUP, group)):
+            for name in self._groups[group]:
+                if self._matches(name):
+                    self.reveal(name)
+                    self._tree.focus_set()
+                    return
+    
+    def _group_opened(self, event=None):
+        group_iid=self._tree.focus()
+        if group_iid.startswith("group:"):
+            group=group_iid[len("group:"):]
+            self._open_groups.add(group)
+            self._show_group(group)
+    
+    def _group_closed(self, event=None):
+        group_iid=self._tree.focus()
+        if group_iid.startswith("group:"):
+            self._open_groups.discard(group_iid[len("group:"):])
+    
+    def _selected_setup(self):
+        # name of the selected setup, None if a group (or nothing) is selected
+        selection=self._tree.selection()
+        if (not selection) or (selection[0] not in self._rows):
+            return None
+        return selection[0]
+    
+    def _selected(self, event=None):
+        selection=self._tree.selection()
+        if selection and selection[0].startswith("more:"): # show the next rows of the group
+            group=selection[0][len("more:"):]
+            self._row_limits[group]=self._row_limits.get(group, GROUP_ROWS)+GROUP_ROWS
+            self._tree.selection_remove(selection[0])
+            self._show_group(group)
+            return
+        setup_name=self._selected_setup()
+        if self._enabled and (setup_name is not None):
+            self._on_select(setup_name)
+    
+    def _activated(self, event=None):
+        setup_name=self._selected_setup()
+        if self._enabled and (setup_name is not None):
+            self._on_activate(setup_name)
+    
+    def reveal(self, setup_name):
+        """
+        Open the group of the setup and select it
+        
+        Parameters
+        ----------
+        setup_name : str
+            name of the setup, nothing is done for unknown setups
+        """
+        group=setup_group(setup_name)
+        if setup_name not in self._groups.get(group, ()):
+            return
+        if self._filter_text and not self._matches(setup_name): # clear the search, the setup would be hidden
+            self._var_search.set("")
+            self._apply_search()
+        visible=[name for name in self._groups[group] if self._matches(name)]
+        index=visible.index(setup_name)
+        if index >= self._row_limits.get(group, GROUP_ROWS): # show rows up to the setup
+            self._row_limits[group]=(index//GROUP_ROWS+1)*GROUP_ROWS
+        self._open_groups.add(group)
+        self._show_group(group)
+        self._tree.item(self._group_iid(group), open=True)
+        self._tree.selection_set(setup_name)
+        self._tree.see(setup_name)
+    
+    def set_enabled(self, enabled):
+        """
+        Enable or disable selecting setups
+        
+        Parameters
+        ----------
+        enabled : boolean
+            False while a setup is being loaded
+        """
+        self._enabled=enabled
+        self._entry_search["state"]="normal" if enabled else "disabled"
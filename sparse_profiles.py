@@ -0,0 +1,170 @@
+import os, fnmatch
+
+from configparser import ConfigParser
+
+FULL_CHECKOUT=None # profile of setups without a matching section, whole tree is checked out
+
+class SparseProfiles():
+    """
+    Folders of the repository checked out for each setup
+    
+    Profiles are read from an ini file where every section name is a
+    setup name or a glob pattern (e.g. [AIR1281_*]) and its "paths"
+    option lists the folders the matching setups need, one per line.
+    First matching section is used, setups without a matching section
+    get the full tree. Top level files are always checked out (git
+    cone mode). The file is read again when its modification time
+    changes.
+    
+    Methods
+    -------
+    reload_if_changed()
+        Read the profiles again if the file has changed
+    profile_for(setup_name)
+        Return folders checked out for the setup
+    patterns_for(setup_name)
+        Return content of the sparse-checkout file for the setup
+    apply(git_dir, setup_name)
+        Write sparse-checkout patterns of the setup to the repository
+    """
+    def __init__(self, file_path):
+        """
+        Parameters
+        ----------
+        file_path : str
+            path to the profiles file, missing file means full checkout
+            for every setup
+        """
+        self._file_path=file_path
+        self._mtime=None
+        self._profiles=[] # (section name, tuple of folders) in file order
+        self._results={} # setup name -> profile, cleared when profiles change
+    
+    def reload_if_changed(self):
+        """
+        Read the profiles again if the file has changed
+        
+        Returns
+        -------
+        boolean
+            True if the profiles were (re)loaded
+        """
+        try:
+            mtime=os.stat(self._file_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime=0 # no file, every setup gets the full tree
+        if mtime == self._mtime:
+            return False
+        self._mtime=mtime
+        parser=ConfigParser()
+        if mtime:
+            parser.read(self._file_path)
+        self._profiles=[]
+        for section in parser.sections():
+            paths=[path.strip().strip("/\\").replace("\\", "/") for path in parser.get(section, "paths", fallback="").splitlines()]
+            self._profiles.append((section, tuple(sorted(path for path in paths if path))))
+        self._results={}
+        return True
+    
+    def profile_for(self, setup_name):
+        """
+        Return folders checked out for the setup
+        
+        Parameters
+        ----------
+        setup_name : str
+            name of the setup (branch)
+        
+        Returns
+        -------
+        tuple or None
+            sorted folder paths relative to the repository root,
+            FULL_CHECKOUT (None) if the whole tree is checked out
+        """
+        self.reload_if_changed()
+        if setup_name not in self._results:
+            self._results[setup_name]=next((paths for section, paths in self._profiles if fnmatch.fnmatchcase(setup_name, section)), FULL_CHECKOUT)
+        return self._results[setup_name]
+    
+    def patterns_for(self, setup_name):
+        """
+        Return content of the sparse-checkout file for the setup
+        
+        Parameters
+        ----------
+        setup_name : str
+            name of the setup (branch)
+        
+        Returns
+        -------
+        str
+            cone mode patterns as written to .git/info/sparse-checkout
+        """
+        return cone_patterns(self.profile_for(setup_name))
+    
+    def apply(self, git_dir, setup_name):
+        """
+        Write sparse-checkout patterns of the setup to the repository
+        
+        Only the patterns file is written, the working tree follows them
+        on the next checkout (or "git sparse-checkout reapply"), so 
+        switching to a setup with another profile writes the files once.
+        
+        Parameters
+        ----------
+        git_dir : str
+            git directory of the repository or worktree
+        setup_name : str
+            name of the setup (branch)
+        
+        Returns
+        -------
+        boolean
+            True if the patterns were changed
+        """
+        patterns=self.patterns_for(setup_name)
+        file_path=os.path.join(git_dir, "info", "sparse-checkout")
+        try:
+            with open(file_path, newline="") as f:
+                if f.read() == patterns:
+                    return False
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w', newline="\n") as f: # git does not expect CRLF in patterns
+            f.write(patterns)
+        return True
+
+def cone_patterns(paths):
+    """
+    Build cone mode sparse-checkout patterns for the folders
+    
+    Every parent folder of a listed folder is included without its
+    other subfolders, the same as "git sparse-checkout set --cone"
+    writes them.
+    
+    Parameters
+    ----------
+    paths : tuple or None
+        folder paths relative to the repository root, None for the
+        whole tree
+    
+    Returns
+    -------
+    str
+        content of the sparse-checkout file
+    """
+    if paths is FULL_CHECKOUT:
+        return "/*\n"
+    lines=["/*", "!/*/"]
+    parents=set()
+    for path in paths:
+        if any(path.startswith(other+"/") for other in paths): # already included with the whole parent folder
+            continue
+        parts=path.split("/")
+        for depth in range(1, len(parts)):
+            parent="/".join(parts[:depth])
+            if parent not in parents:
+                parents.add(parent)
+                lines+=["/{}/".format(parent), "!/{}/*/".format(parent)]
+        lines.append("/{}/".format(path))
+    return "\n".join(lines)+"\n"
@@ -0,0 +1,96 @@
+import hmac, hashlib, threading
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """
+    Handle push webhooks sent by the git server
+    
+    Any POST request with a valid token or signature triggers a 
+    refresh, the payload itself is not parsed: the git manager finds
+    out what changed with a single ls-remote.
+    """
+    def do_POST(self):
+        length=int(self.headers.get("Content-Length", 0))
+        body=self.rfile.read(length)
+        if not self.server.authorized(self.headers, body):
+            self._reply(403)
+            return
+        self.server.callback()
+        self._reply(202)
+    
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+    
+    def log_message(self, format, *args):
+        pass # do not print a line for every request
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """
+    Receiver of push webhooks, each request in its own thread
+    
+    Methods
+    -------
+    start()
+        Serve requests in a background thread
+    authorized(headers, body)
+        Check token or signature of the request
+    """
+    daemon_threads=True
+    
+    def __init__(self, port, secret, callback, host="0.0.0.0"):
+        """
+        Parameters
+        ----------
+        port : int
+            port to listen on
+        secret : str
+            token (X-Gitlab-Token header) or signing secret 
+            (X-Hub-Signature-256 header of GitHub and Gitea), empty 
+            string accepts every request
+        callback : function
+            called without arguments when a webhook is received
+        host : str, optional
+            address to listen on, all interfaces by default so the git 
+            server can reach it
+        """
+        ThreadingHTTPServer.__init__(self, (host, port), WebhookHandler)
+        self._secret=secret
+        self.callback=callback
+    
+    def start(self):
+        """
+        Serve requests in a background thread
+        """
+        threading.Thread(target=self.serve_forever, name="webhook", daemon=True).start()
+    
+    def authorized(self, headers, body):
+        """
+        Check token or signature of the request
+        
+        Parameters
+        ----------
+        headers : email.message.Message
+            headers of the request
+        body : bytes
+            payload of the request
+        
+        Returns
+        -------
+        boolean
+            True if no secret is configured or the request carries the 
+            right token or signature
+        """
+        if not self._secret:
+            return True
+        token=headers.get("X-Gitlab-Token")
+        if token is not None:
+            return hmac.compare_digest(token.encode(), self._secret.encode())
+        signature=headers.get("X-Hub-Signature-256")
+        if signature is not None:
+            expected="sha256="+hmac.new(self._secret.encode(), body, hashlib.sha256).hexdigest()
+            return hmac.compare_digest(signature.encode(), expected.encode())
+        return False